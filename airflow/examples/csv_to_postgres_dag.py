@@ -1,14 +1,238 @@
+import fcntl
 import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional
 
 import dlt
 import duckdb
-from dlt.common.schema.typing import TWriteDispositionConfig
-from dlt.sources.filesystem import readers
+import psycopg2
+from dlt.common.destination import TLoaderFileFormat
+from dlt.common.normalizers.naming import snake_case
+from dlt.common.schema.typing import TColumnSchema, TWriteDispositionConfig
+from dlt.common.typing import TDataItems
+from dlt.destinations.impl.postgres.factory import PostgresTypeMapper
+from dlt.sources.filesystem import FileItemDict, filesystem
+from dlt.sources.filesystem.helpers import fetch_json
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
 
 from airflow import DAG
 from airflow.providers.standard.operators.python import PythonOperator
+from airflow.stats import Stats
+
+
+# Load modes for the ratings and tags tables:
+# - full: skip tables that already have data, otherwise replace them
+# - incremental: load only rows past the "timestamp" high-water mark kept in
+#   the pipeline state, merging ratings and tags on their primary keys
+LOAD_MODES = ("full", "incremental")
+
+BUCKET = "movie-lens"
+
+# Tables loaded by the DAG, with the write disposition used in incremental
+# mode (None: always loaded in full)
+MOVIELENS_TABLES: Dict[str, Dict[str, Any]] = {
+    "movies": {"primary_key": ["movieId"], "incremental": None},
+    "ratings": {"primary_key": ["userId", "movieId"], "incremental": "merge"},
+    "tags": {
+        "primary_key": ["userId", "movieId", "timestamp"],
+        "incremental": "merge",
+    },
+}
+
+# Airflow pool of the mapped loads and the DAG's task concurrency, which
+# bound how many files load at once across the workers
+LOAD_POOL = os.getenv("CSV_TO_POSTGRES_POOL", "default_pool")
+MAX_ACTIVE_TASKS = int(os.getenv("CSV_TO_POSTGRES_MAX_ACTIVE_TASKS", "16"))
+
+# Connections for catalog lookups, shared by all resources in the process
+_connection_pools: Dict[str, ThreadedConnectionPool] = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(dsn: str) -> ThreadedConnectionPool:
+    """Return a process-wide connection pool for the given PostgreSQL URL."""
+    with _connection_pools_lock:
+        if dsn not in _connection_pools:
+            _connection_pools[dsn] = ThreadedConnectionPool(
+                0, 4, dsn, connect_timeout=10, options="-c statement_timeout=30000"
+            )
+        return _connection_pools[dsn]
+
+
+# Dataset that replace loads with deferred indexes are loaded into before
+# being swapped into the main dataset
+BULK_DATASET_SUFFIX = "_bulk"
+
+# Pseudo column type for integer Unix seconds, loaded as timestamps
+EPOCH = "EPOCH"
+
+# dlt hints for the declared DuckDB column types. Integer precision picks
+# smallint/integer/bigint on PostgreSQL, float precision real or double
+# precision (see CompactPostgresTypeMapper)
+COLUMN_HINTS: Dict[str, TColumnSchema] = {
+    "SMALLINT": {"data_type": "bigint", "precision": 16},
+    "INTEGER": {"data_type": "bigint", "precision": 32},
+    "BIGINT": {"data_type": "bigint", "precision": 64},
+    "FLOAT": {"data_type": "double", "precision": 24},
+    "REAL": {"data_type": "double", "precision": 24},
+    "DOUBLE": {"data_type": "double"},
+    "BOOLEAN": {"data_type": "bool"},
+    "VARCHAR": {"data_type": "text"},
+    "DATE": {"data_type": "date"},
+    EPOCH: {"data_type": "timestamp", "timezone": True},
+}
+
+
+class CompactPostgresTypeMapper(PostgresTypeMapper):
+    """Map doubles of up to 24 bits precision to real (float4) on PostgreSQL.
+
+    dlt's PostgreSQL type mapper loads every double as double precision.
+    """
+
+    dbt_to_sct = {**PostgresTypeMapper.dbt_to_sct, "real": "double"}
+
+    def to_destination_type(self, column: TColumnSchema, table: Any) -> str:
+        if column["data_type"] == "double" and (column.get("precision") or 53) <= 24:
+            return "real"
+        return super().to_destination_type(column, table)
+
+
+# Declared MovieLens columns, in file order: ids fit in integer, ratings are
+# 0.5-5.0 stars and timestamps are Unix seconds
+MOVIELENS_COLUMNS = {
+    "movies": {"movieId": "INTEGER", "title": "VARCHAR", "genres": "VARCHAR"},
+    "ratings": {
+        "userId": "INTEGER",
+        "movieId": "INTEGER",
+        "rating": "FLOAT",
+        "timestamp": EPOCH,
+    },
+    "tags": {
+        "userId": "INTEGER",
+        "movieId": "INTEGER",
+        "tag": "VARCHAR",
+        "timestamp": EPOCH,
+    },
+}
+
+
+def cpu_allotment() -> int:
+    """Return the number of CPUs this task may use: its cgroup quota, else its affinity."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
+def bucket_url(bucket: str) -> str:
+    """Return the S3 URL of a bucket name; full URLs (e.g. file://) pass through."""
+    return bucket if "://" in bucket else f"s3://{bucket}"
+
+
+def table_row_counts(step_info: Any) -> Dict[str, int]:
+    """Rows of each data table a step wrote, from the step's table metrics."""
+    counts: Dict[str, int] = {}
+    for step_metrics in step_info.metrics.values() if step_info else []:
+        for load_metrics in step_metrics:
+            for table, metrics in load_metrics["table_metrics"].items():
+                if not table.startswith("_dlt"):
+                    counts[table] = counts.get(table, 0) + metrics.items_count
+    return counts
+
+
+@dlt.transformer
+def read_csv_shards(
+    items: Iterator[FileItemDict],
+    readers: int = 4,
+    chunk_size: int = 10000,
+    use_pyarrow: bool = False,
+    columns: Optional[Dict[str, str]] = None,
+    **duckdb_kwargs: Any,
+) -> Iterator[TDataItems]:
+    """Read CSV files with a bounded pool of readers, yielding chunks as they arrive.
+
+    Each reader uses its own DuckDB connection, since connections must not be
+    shared between threads. At most readers * 2 chunks are buffered.
+
+    With use_pyarrow, chunks are Arrow record batches instead of lists of
+    dicts, so dlt extracts and normalizes them column-wise.
+
+    With columns (name -> DuckDB type, or EPOCH), files are read with those
+    types instead of being sniffed, and EPOCH columns are converted to
+    timestamps.
+    """
+    if columns:
+        read_types = {
+            name: "BIGINT" if type_.upper() == EPOCH else type_
+            for name, type_ in columns.items()
+        }
+        projection = ", ".join(
+            f'to_timestamp("{name}") AS "{name}"'
+            if type_.upper() == EPOCH
+            else f'"{name}"'
+            for name, type_ in columns.items()
+        )
+
+    chunks: queue.Queue = queue.Queue(maxsize=readers * 2)
+    done = object()
+    cancelled = threading.Event()
+
+    def read(item: FileItemDict) -> None:
+        try:
+            conn = duckdb.connect()
+            try:
+                with item.open() as f:
+                    if columns:
+                        relation = conn.read_csv(f, columns=read_types, **duckdb_kwargs)
+                        relation = relation.project(projection)
+                    else:
+                        relation = conn.from_csv_auto(f, **duckdb_kwargs)
+                    if use_pyarrow:
+                        batches = relation.fetch_record_batch(chunk_size)
+                    else:
+                        batches = fetch_json(relation, chunk_size)
+                    for chunk in batches:
+                        if cancelled.is_set():
+                            break
+                        chunks.put(chunk)
+            finally:
+                conn.close()
+            chunks.put(done)
+        except BaseException as e:
+            chunks.put(e)
+
+    items = list(items)
+    remaining = len(items)
+    with ThreadPoolExecutor(max_workers=max(1, min(readers, remaining))) as pool:
+        for item in items:
+            pool.submit(read, item)
+        try:
+            while remaining:
+                chunk = chunks.get()
+                if chunk is done or isinstance(chunk, BaseException):
+                    remaining -= 1
+                    if chunk is not done:
+                        raise chunk
+                else:
+                    yield chunk
+        finally:
+            cancelled.set()
+            # Unblock readers waiting on a full queue
+            while remaining:
+                chunk = chunks.get()
+                if chunk is done or isinstance(chunk, BaseException):
+                    remaining -= 1
 
 
 class DltResource:
@@ -18,6 +242,13 @@ class DltResource:
         self.pipeline_name = "minio_to_postgres"
         self.destination = "postgres"
         self.dataset_name = "movielens_af"
+        # "csv" streams files with COPY FROM STDIN, "parquet" uses ADBC bulk
+        # ingest (needs adbc-driver-postgresql), "insert_values" uses INSERT batches
+        self.loader_file_format = "csv"
+        # Keep pipeline working directories (state, schemas, pending load
+        # packages) here, e.g. on the DAGs PVC, so tasks on any worker start
+        # warm. Unset: dlt's default under ~/.dlt, restored from the destination
+        self.pipelines_dir = os.getenv("DLT_PIPELINES_DIR") or None
 
     def setup_environment(self):
         """Setup environment variables for dlt."""
@@ -30,91 +261,201 @@ class DltResource:
         # Enable detailed logging for dlt
         os.environ["DLT_LOG_LEVEL"] = "INFO"
 
-    def create_pipeline(self, table_name: str):
-        """Create dlt pipeline with optional table-specific name."""
+        # Size dlt's worker pools to the task's CPUs unless set explicitly:
+        # extract threads read CSV shards, normalize processes and load jobs
+        # work on files rotated every FILE_MAX_ITEMS rows
+        cpus = cpu_allotment()
+        os.environ.setdefault("EXTRACT__WORKERS", str(cpus))
+        os.environ.setdefault("NORMALIZE__WORKERS", str(cpus))
+        # Loading mostly waits on PostgreSQL
+        os.environ.setdefault("LOAD__WORKERS", str(cpus * 2))
+        os.environ.setdefault("EXTRACT__DATA_WRITER__FILE_MAX_ITEMS", "500000")
+        os.environ.setdefault("NORMALIZE__DATA_WRITER__FILE_MAX_ITEMS", "500000")
+        if self.pipelines_dir:
+            # Files of completed load jobs would pile up on the shared volume
+            os.environ.setdefault("LOAD__DELETE_COMPLETED_JOBS", "true")
+
+    def create_pipeline(
+        self, table_name: str, bulk: bool = False, shard: Optional[int] = None
+    ):
+        """Create dlt pipeline with optional table-specific name.
+
+        With bulk, the pipeline loads into the bulk dataset and creates no
+        indexes. Shards of a table get pipelines of their own, so they can
+        load concurrently.
+        """
         self.setup_environment()
 
         if table_name:
             pipeline_name = f"{self.pipeline_name}_{table_name}"
         else:
             pipeline_name = self.pipeline_name
+        if shard is not None:
+            pipeline_name = f"{pipeline_name}_{shard}"
 
-        return dlt.pipeline(
+        pipeline = dlt.pipeline(
             pipeline_name=pipeline_name,
-            destination=self.destination,
-            dataset_name=self.dataset_name,
+            pipelines_dir=self.pipelines_dir,
+            destination=(
+                dlt.destinations.postgres(
+                    type_mapper=CompactPostgresTypeMapper, create_indexes=not bulk
+                )
+                if self.destination == "postgres"
+                else self.destination
+            ),
+            dataset_name=(
+                f"{self.dataset_name}{BULK_DATASET_SUFFIX}"
+                if bulk
+                else self.dataset_name
+            ),
+        )
+        if self.pipelines_dir:
+            # State and schemas are kept on pipelines_dir, so runs neither
+            # restore them from the destination nor store them there
+            pipeline.config.restore_from_destination = False
+        return pipeline
+
+    @contextmanager
+    def pipeline_lock(self, pipeline_name: str) -> Iterator[None]:
+        """Hold an exclusive lock on a pipeline's working directory.
+
+        Only taken with pipelines_dir: runs of the same pipeline on other
+        workers wait instead of writing the same state and load packages.
+        """
+        if not self.pipelines_dir:
+            yield
+            return
+        os.makedirs(self.pipelines_dir, exist_ok=True)
+        lock_path = os.path.join(self.pipelines_dir, f"{pipeline_name}.lock")
+        with open(lock_path, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print(f"Waiting for another run of pipeline '{pipeline_name}'")
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def list_files(self, bucket: str, file_glob: str) -> List[Dict[str, Any]]:
+        """List files in S3/MinIO matching file_glob, with their paths and sizes."""
+        self.setup_environment()
+
+        files = filesystem(
+            bucket_url=bucket_url(bucket), file_glob=file_glob, files_per_page=1000
         )
+        return [
+            {"path": item["relative_path"], "size": item["size_in_bytes"]}
+            for item in files
+        ]
 
-    def read_csv_from_s3(self, bucket: str, file_glob: str, chunk_size: int = 10000):
-        """Read CSV file from S3/MinIO using dlt filesystem readers."""
+    def read_csv_from_s3(
+        self,
+        bucket: str,
+        file_glob: str,
+        chunk_size: Optional[int] = None,
+        incremental_cursor: Optional[str] = None,
+        use_pyarrow: bool = True,
+        columns: Optional[Dict[str, str]] = None,
+        initial_value: Optional[Any] = None,
+    ):
+        """Read CSV files from S3/MinIO, sharded globs in parallel.
+
+        All files matching file_glob are read concurrently by up to
+        EXTRACT__WORKERS readers.
+
+        With incremental_cursor, only files modified since the last run are
+        read, and only rows whose cursor column is at or above the high-water
+        mark kept in the pipeline state are passed on. Without a stored mark,
+        only rows from initial_value on are passed on (see cursor_start()).
+
+        With use_pyarrow (the default), DuckDB results are passed to dlt as
+        Arrow record batches of chunk_size rows (default 100000), so no Python
+        objects are created per cell. Otherwise rows are passed as dicts in
+        chunks of 10000.
+
+        columns declares the file's columns as name -> DuckDB type, in file
+        order. Declared files are not sniffed, and the types are applied as
+        dlt column hints so nothing is inferred: INTEGER loads as integer
+        rather than bigint, and EPOCH (integer Unix seconds) as timestamp
+        with time zone.
+        """
         self.setup_environment()
 
-        print(f"Reading CSV from s3://{bucket}/{file_glob}")
+        readers = int(os.environ["EXTRACT__WORKERS"])
+        chunk_size = chunk_size or (100000 if use_pyarrow else 10000)
+        print(
+            f"Reading CSV from {bucket_url(bucket)}/{file_glob} with {readers} readers"
+        )
 
-        csv_reader = readers(
-            bucket_url=f"s3://{bucket}",
+        files = filesystem(
+            bucket_url=bucket_url(bucket),
             file_glob=file_glob,
-        ).read_csv_duckdb(
+            files_per_page=1000,
+        )
+        if incremental_cursor:
+            files.apply_hints(incremental=dlt.sources.incremental("modification_date"))
+
+        rows = files | read_csv_shards(
+            readers=readers,
             chunk_size=chunk_size,
+            use_pyarrow=use_pyarrow,
+            columns=columns,
             header=True,
         )
+        if columns:
+            rows.apply_hints(
+                columns={
+                    name: {"name": name, **COLUMN_HINTS[type_.upper()]}
+                    for name, type_ in columns.items()
+                    if type_.upper() in COLUMN_HINTS
+                }
+            )
+        if incremental_cursor:
+            rows.apply_hints(
+                incremental=dlt.sources.incremental(
+                    incremental_cursor,
+                    initial_value=initial_value,
+                )
+            )
 
-        return csv_reader
+        return rows
 
     def table_exists_and_has_data(self, table_name: str) -> bool:
-        """Check if table exists and has data using DuckDB PostgreSQL scanner."""
-        conn: duckdb.DuckDBPyConnection | None = None
-
-        try:
-            postgres_url = os.getenv("POSTGRES_URL", "")
-            url_parts = postgres_url.replace("postgresql://", "").split("/")
-            auth_host = url_parts[0]
-
-            if "@" in auth_host:
-                auth, host_port = auth_host.split("@")
-                if ":" in auth:
-                    user, password = auth.split(":", 1)
-                else:
-                    user, password = auth, ""
-            else:
-                host_port = auth_host
-                user, password = "", ""
+        """Check if table exists and has at least one row.
 
-            if ":" in host_port:
-                host, port = host_port.rsplit(":", 1)
-            else:
-                host, port = host_port, "5432"
-
-            conn = duckdb.connect()
-            conn.execute("INSTALL postgres_scanner")
-            conn.execute("LOAD postgres_scanner")
-
-            attach_cmd = f"""
-            ATTACH 'host={host} port={port} dbname={self.dataset_name} user={user} password={password}' AS postgres_db (TYPE postgres)
-            """
-            conn.execute(attach_cmd)
-
-            query = f"""
-            SELECT COUNT(*) as row_count
-            FROM postgres_db.{self.dataset_name}.{table_name}
-            LIMIT 1
-            """
-
-            result = conn.execute(query).fetchone()
-            row_count = result[0] if result else 0
+        Looks the table up in the catalog and probes a single row, so the
+        check takes milliseconds regardless of the table size.
+        """
+        pool = get_connection_pool(
+            f"{os.getenv('POSTGRES_URL', '')}/{self.dataset_name}"
+        )
+        conn = None
+        broken = False
 
-            print(f"Table {table_name} has {row_count} rows")
-            return row_count > 0
+        try:
+            conn = pool.getconn()
+            conn.autocommit = True
+            table = sql.Identifier(self.dataset_name, table_name)
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass(%s)", (table.as_string(conn),))
+                if cur.fetchone()[0] is None:
+                    print(f"Table {table_name} does not exist")
+                    return False
+                cur.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(table))
+                has_data = cur.fetchone()[0]
+
+            print(f"Table {table_name} {'has data' if has_data else 'is empty'}")
+            return has_data
 
         except Exception as e:
-            print(f"Table {table_name} does not exist or is empty: {e}")
+            broken = isinstance(e, psycopg2.Error)
+            print(f"Could not check table {table_name}, assuming it is missing: {e}")
             return False
         finally:
-            try:
-                if conn:
-                    conn.close()
-            except Exception:
-                pass
+            if conn is not None:
+                pool.putconn(conn, close=broken or bool(conn.closed))
 
     def run_pipeline(
         self,
@@ -122,29 +463,75 @@ class DltResource:
         table_name: str,
         write_disposition: TWriteDispositionConfig = "replace",
         primary_key: str = "",
+        loader_file_format: Optional[TLoaderFileFormat] = None,
+        deferred_indexes: bool = False,
+        swap: bool = True,
+        shard: Optional[int] = None,
     ) -> Dict[str, Any]:
-        """Run dlt pipeline with given resource data."""
-        pipeline = self.create_pipeline(table_name=table_name)
+        """Run dlt pipeline with given resource data.
+
+        Data is loaded in files of loader_file_format (default
+        self.loader_file_format), up to LOAD__WORKERS files at a time.
+
+        With deferred_indexes, a replace load goes into an unindexed table in
+        the bulk dataset, and its indexes are built before it is swapped in
+        (see swap_in_bulk_table). Readers keep seeing the old table until then.
+        With swap=False the table is left in the bulk dataset, where further
+        shards can be appended, and the result carries the constraints to pass
+        to swap_in_bulk_table once all of them are loaded.
+        """
+        if deferred_indexes and (
+            write_disposition not in (("replace",) if swap else ("replace", "append"))
+            or self.destination != "postgres"
+        ):
+            raise ValueError(
+                "deferred_indexes requires a replace (or, without swap, append) "
+                "load into postgres"
+            )
+        loader_file_format = loader_file_format or self.loader_file_format
+        pipeline = self.create_pipeline(
+            table_name=table_name, bulk=deferred_indexes, shard=shard
+        )
 
         print(f"Running pipeline '{pipeline.pipeline_name}' for table {table_name}")
 
         pipeline.config.progress = "log"
 
-        load_info = pipeline.run(
-            resource_data, table_name=table_name, write_disposition=write_disposition
-        )
+        with self.pipeline_lock(pipeline.pipeline_name):
+            load_info = pipeline.run(
+                resource_data,
+                table_name=table_name,
+                write_disposition=write_disposition,
+                loader_file_format=loader_file_format,
+            )
 
         print(f"Pipeline completed for {table_name}")
 
+        stage_metrics = self.stage_metrics(pipeline)
+        constraints = self.bulk_constraints(pipeline, table_name)
+        if deferred_indexes and swap:
+            seconds = self.swap_in_bulk_table(table_name, constraints)
+            rows = stage_metrics.get("load", {}).get("rows", 0)
+            stage_metrics["index"] = {
+                "rows": rows,
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(rows / seconds) if seconds > 0 else 0,
+            }
+        for stage, metrics in stage_metrics.items():
+            throughput = f"{metrics['rows_per_second']} rows/s"
+            if "bytes_per_second" in metrics:
+                throughput += f", {metrics['bytes_per_second']} bytes/s"
+            print(
+                f"{stage}: {metrics['rows']} rows in {metrics['seconds']}s "
+                f"({throughput})"
+            )
+        self.publish_metrics(pipeline.pipeline_name, table_name, stage_metrics)
+
         if load_info.load_packages:
             package = load_info.load_packages[0]
             completed_jobs = package.jobs.get("completed_jobs", [])
 
-            total_rows = sum(
-                getattr(job, "rows_count", 0)
-                for job in completed_jobs
-                if hasattr(job, "rows_count")
-            )
+            total_rows = stage_metrics.get("load", {}).get("rows", 0)
 
             return {
                 "load_id": load_info.loads_ids[0] if load_info.loads_ids else None,
@@ -154,7 +541,12 @@ class DltResource:
                 "destination": self.destination,
                 "dataset_name": self.dataset_name,
                 "write_disposition": write_disposition,
+                "loader_file_format": loader_file_format,
+                "deferred_indexes": deferred_indexes,
+                "constraints": constraints,
                 "total_rows": total_rows,
+                "stage_metrics": stage_metrics,
+                "high_water_mark": self.high_water_mark(pipeline),
             }
 
         return {
@@ -164,125 +556,401 @@ class DltResource:
             "dataset_name": self.dataset_name,
         }
 
+    def bulk_constraints(self, pipeline, table_name: str) -> List[List[Any]]:
+        """Constraints dlt would have created for a table, as [name, kind, columns]."""
+        columns = pipeline.default_schema.tables.get(table_name, {}).get("columns", {})
+        constraints: List[List[Any]] = []
+        primary_key = [name for name, col in columns.items() if col.get("primary_key")]
+        if primary_key:
+            constraints.append([f"{table_name}_pkey", "PRIMARY KEY", primary_key])
+        for name, col in columns.items():
+            if col.get("unique"):
+                constraints.append([f"{table_name}_{name}_key", "UNIQUE", [name]])
+        return constraints
+
+    def swap_in_bulk_table(
+        self, table_name: str, constraints: List[List[Any]]
+    ) -> float:
+        """Index a table loaded into the bulk dataset and swap it in.
+
+        The constraints (see bulk_constraints) are built as indexes
+        concurrently on the loaded table. Then, in one transaction, they are
+        attached, the live table is dropped and the loaded one is moved into
+        its place, so readers see either the old or the new table. An empty
+        copy is left in the bulk dataset for the next load. Returns the
+        seconds taken.
+        """
+        started = time.monotonic()
+        bulk_dataset = f"{self.dataset_name}{BULK_DATASET_SUFFIX}"
+        bulk_table = sql.Identifier(bulk_dataset, table_name)
+        live_table = sql.Identifier(self.dataset_name, table_name)
+
+        pool = get_connection_pool(
+            f"{os.getenv('POSTGRES_URL', '')}/{self.dataset_name}"
+        )
 
-# Task functions
-def process_movies_table(**context):
-    """Load movies CSV from MinIO to PostgreSQL using dlt."""
-    dlt_resource = DltResource()
+        def execute(statements: List[sql.Composable], autocommit: bool) -> None:
+            conn = pool.getconn()
+            broken = False
+            try:
+                conn.autocommit = autocommit
+                with conn.cursor() as cur:
+                    # Index builds outlast the pool's statement timeout
+                    cur.execute("SET statement_timeout = 0")
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.execute("RESET statement_timeout")
+                if not autocommit:
+                    conn.commit()
+            except psycopg2.Error:
+                broken = True
+                raise
+            finally:
+                pool.putconn(conn, close=broken or bool(conn.closed))
+
+        def build_index(constraint: List[Any]) -> None:
+            index, _, index_columns = constraint
+            print(f"Building index {index} on {table_name}")
+            execute(
+                [
+                    # Left over by a run that failed before the swap
+                    sql.SQL("DROP INDEX IF EXISTS {}").format(
+                        sql.Identifier(bulk_dataset, index)
+                    ),
+                    sql.SQL("CREATE UNIQUE INDEX {} ON {} ({})").format(
+                        sql.Identifier(index),
+                        bulk_table,
+                        sql.SQL(", ").join(map(sql.Identifier, index_columns)),
+                    ),
+                ],
+                autocommit=True,
+            )
 
-    print("Starting movies pipeline...")
+        if constraints:
+            with ThreadPoolExecutor(max_workers=min(len(constraints), 4)) as executor:
+                list(executor.map(build_index, constraints))
 
-    table_exists = dlt_resource.table_exists_and_has_data("movies")
-    if table_exists:
-        print("Movies table already exists with data, skipping import")
-        return {"status": "skipped", "reason": "table already exists with data"}
+        swap: List[sql.Composable] = [
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {} USING INDEX {}").format(
+                bulk_table, sql.Identifier(index), sql.SQL(kind), sql.Identifier(index)
+            )
+            for index, kind, _ in constraints
+        ]
+        swap += [
+            sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(
+                sql.Identifier(self.dataset_name)
+            ),
+            sql.SQL("DROP TABLE IF EXISTS {}").format(live_table),
+            sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(
+                bulk_table, sql.Identifier(self.dataset_name)
+            ),
+            sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)").format(
+                bulk_table, live_table
+            ),
+        ]
+        execute(swap, autocommit=False)
+
+        seconds = time.monotonic() - started
+        print(
+            f"Swapped in {table_name} with {len(constraints)} indexes in {seconds:.1f}s"
+        )
+        return seconds
+
+    def stage_metrics(self, pipeline) -> Dict[str, Dict[str, Any]]:
+        """Rows, files, bytes and duration of each step of the pipeline's last run.
+
+        Rows are dlt's per-table row counts of the data each step wrote
+        (extract, normalize) or loaded (load: the normalized rows of the
+        tables whose jobs completed). dlt's writer for dict rows in CSV
+        files counts their non-null cells, so with the rows reader and the
+        csv loader file format, normalize and load report cells. Files and
+        bytes are those of the step's data files, with rows/s and bytes/s
+        over the step.
+        """
+        trace = pipeline.last_trace
+        extracted = table_row_counts(trace.last_extract_info)
+        normalized = {
+            table: rows
+            for table, rows in (
+                trace.last_normalize_info.row_counts
+                if trace.last_normalize_info
+                else {}
+            ).items()
+            if not table.startswith("_dlt")
+        }
 
-    print("Reading movies.csv from MinIO...")
-    movies_data = dlt_resource.read_csv_from_s3(
-        bucket="movie-lens", file_glob="movies.csv"
-    )
+        metrics: Dict[str, Dict[str, Any]] = {}
+        for step in trace.steps:
+            if (
+                step.step not in ("extract", "normalize", "load")
+                or not step.finished_at
+            ):
+                continue
+            seconds = (step.finished_at - step.started_at).total_seconds()
+            jobs = [
+                job
+                for package in getattr(step.step_info, "load_packages", None) or []
+                for state_jobs in package.jobs.values()
+                for job in state_jobs
+                if not job.job_file_info.table_name.startswith("_dlt")
+            ]
+            size = sum(job.file_size for job in jobs)
+            if step.step == "load":
+                loaded_tables = {
+                    job.job_file_info.table_name
+                    for package in step.step_info.load_packages
+                    for job in package.jobs.get("completed_jobs", [])
+                }
+                rows = sum(normalized.get(table, 0) for table in loaded_tables)
+            else:
+                counts = extracted if step.step == "extract" else normalized
+                rows = sum(counts.values())
+            metrics[step.step] = {
+                "rows": rows,
+                "files": len(jobs),
+                "bytes": size,
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(rows / seconds) if seconds > 0 else 0,
+                "bytes_per_second": round(size / seconds) if seconds > 0 else 0,
+            }
+        return metrics
+
+    def publish_metrics(
+        self, pipeline_name: str, table_name: str, stage_metrics: Dict[str, Any]
+    ) -> None:
+        """Send stage metrics to StatsD as dlt.<pipeline>.<table>.<stage>.<measure>.
+
+        The chart's statsd-exporter maps them to airflow_dlt_stage_<measure>
+        gauges labelled by pipeline, table and stage. Without StatsD this does
+        nothing.
+        """
+        for stage, metrics in stage_metrics.items():
+            for measure, value in metrics.items():
+                Stats.gauge(
+                    f"dlt.{pipeline_name}.{table_name}.{stage}.{measure}", value
+                )
 
-    movies_data.apply_hints(primary_key="movieId")
+    def cursor_state(self, pipeline) -> Dict[str, Any]:
+        """Return the incremental state of the row cursor stored by the last run."""
+        for source_state in pipeline.state.get("sources", {}).values():
+            for resource_state in source_state.get("resources", {}).values():
+                for cursor, state in resource_state.get("incremental", {}).items():
+                    if (
+                        cursor != "modification_date"
+                        and state.get("last_value") is not None
+                    ):
+                        return state
+        return {}
+
+    def high_water_mark(self, pipeline) -> Optional[Any]:
+        """Return the incremental cursor value stored by the last run, if any."""
+        return self.cursor_state(pipeline).get("last_value")
+
+    def cursor_start(self, table_name: str, cursor: str) -> Optional[Any]:
+        """Return the value an incremental load of the table should start at.
+
+        Full loads keep no high-water mark, so the first incremental run after
+        one would read every row again. If the pipeline has no stored mark
+        (locally or in the destination), the largest cursor value already in
+        the table is returned: that run reads the rows at it again, which the
+        merge on the primary key drops, and stores a mark with the hashes dlt
+        uses to skip them from then on. Otherwise None, and dlt starts at the
+        stored mark.
+        """
+        pipeline = self.create_pipeline(table_name=table_name)
+        if pipeline.config.restore_from_destination:
+            pipeline.sync_destination()
+        state = self.cursor_state(pipeline)
+        if state:
+            return None
+        if not self.table_exists_and_has_data(table_name):
+            return None
+
+        column = sql.Identifier(
+            snake_case.NamingConvention().normalize_identifier(cursor)
+        )
+        table = sql.Identifier(self.dataset_name, table_name)
+        with pipeline.sql_client() as client:
+            rows = client.execute_sql(
+                sql.SQL("SELECT max({}) FROM {}")
+                .format(column, table)
+                .as_string(client.native_connection)
+            )
+        start = rows[0][0] if rows else None
+        print(f"No high-water mark stored for {table_name}, starting at {start}")
+        return start
 
-    result = dlt_resource.run_pipeline(
-        movies_data,
-        table_name="movies",
-        write_disposition="replace",
-    )
 
-    print(f"Movies pipeline completed: {result}")
-    return result
+# Task functions
+def get_load_mode(context: Dict[str, Any]) -> str:
+    """Return the load mode from the DAG run params: "full" or "incremental"."""
+    mode = context["params"].get("mode", "full")
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {LOAD_MODES}")
+    return mode
 
 
-def process_ratings_table(**context):
-    """Load ratings CSV from MinIO to PostgreSQL using dlt."""
-    dlt_resource = DltResource()
+def table_for_file(path: str) -> Optional[str]:
+    """Return the MovieLens table a CSV file belongs to, if any.
 
-    print("Starting ratings pipeline...")
+    Files are matched by name: movies.csv, ratings_000.csv or ratings/*.csv.
+    """
+    name = path.split("/", 1)[0]
+    table = re.sub(r"([._-]\d+)?\.csv$", "", name)
+    return table if table in MOVIELENS_TABLES else None
 
-    table_exists = dlt_resource.table_exists_and_has_data("ratings")
-    if table_exists:
-        print("Ratings table already exists with data, skipping import")
-        return {"status": "skipped", "reason": "table already exists with data"}
 
-    print("Reading ratings.csv from MinIO...")
-    ratings_data = dlt_resource.read_csv_from_s3(
-        bucket="movie-lens", file_glob="ratings.csv"
-    )
+def discover_files(**context):
+    """List the bucket and plan one load per file.
 
-    ratings_data.apply_hints(primary_key=["userId", "movieId"])
+    In full mode a table is replaced: its first file is loaded into the bulk
+    dataset, the other files are appended to it in parallel, and
+    finalize_load swaps it in. Tables that already have data are skipped.
+    Returns the first loads; the appends and replaced tables are pushed as
+    the "appends" and "replaced" XComs.
 
-    result = dlt_resource.run_pipeline(
-        ratings_data, table_name="ratings", write_disposition="replace"
-    )
-
-    print(f"Ratings pipeline completed: {result}")
-    return result
+    In incremental mode ratings and tags are loaded by one task each, past
+    their high-water mark, since dlt merges through a single staging table.
+    """
+    dlt_resource = DltResource()
+    mode = get_load_mode(context)
+
+    files: Dict[str, List[str]] = {}
+    for file in dlt_resource.list_files(BUCKET, "**/*.csv"):
+        table = table_for_file(file["path"])
+        if table:
+            files.setdefault(table, []).append(file["path"])
+
+    first: List[Dict[str, Any]] = []
+    rest: List[Dict[str, Any]] = []
+    replaced: List[str] = []
+    for table, paths in sorted(files.items()):
+        paths.sort()
+        incremental_disposition = MOVIELENS_TABLES[table]["incremental"]
+        if mode == "incremental" and incremental_disposition:
+            file_glob = (
+                f"{table}/**/*.csv"
+                if all("/" in path for path in paths)
+                else f"{table}*.csv"
+            )
+            shard = {
+                "table": table,
+                "file_glob": file_glob,
+                "write_disposition": incremental_disposition,
+                "incremental": True,
+                "index": None,
+            }
+            first.append({"shard": shard})
+            continue
+
+        if dlt_resource.table_exists_and_has_data(table):
+            print(f"Table {table} already exists with data, skipping import")
+            continue
+        replaced.append(table)
+        for index, path in enumerate(paths):
+            shard = {
+                "table": table,
+                "file_glob": path,
+                "write_disposition": "replace" if index == 0 else "append",
+                "incremental": False,
+                "index": index,
+            }
+            (first if index == 0 else rest).append({"shard": shard})
 
+    print(
+        f"Planned {len(first) + len(rest)} loads in {mode} mode "
+        f"({len(rest)} appended shards), replacing {replaced}"
+    )
+    context["ti"].xcom_push(key="appends", value=rest)
+    context["ti"].xcom_push(key="replaced", value=replaced)
+    return first
 
-def process_tags_table(**context):
-    """Load tags CSV from MinIO to PostgreSQL using dlt."""
-    dlt_resource = DltResource()
 
-    print("Starting tags pipeline...")
+def list_appends(**context):
+    """Return the appends planned by discover_files, to map load_shards over."""
+    return context["ti"].xcom_pull(task_ids="discover_files", key="appends")
 
-    table_exists = dlt_resource.table_exists_and_has_data("tags")
-    if table_exists:
-        print("Tags table already exists with data, skipping import")
-        return {"status": "skipped", "reason": "table already exists with data"}
 
-    print("Reading tags.csv from MinIO...")
-    tags_data = dlt_resource.read_csv_from_s3(bucket="movie-lens", file_glob="tags.csv")
+def load_shard(shard: Dict[str, Any], **context):
+    """Load one file, or one table in incremental mode, planned by discover_files."""
+    dlt_resource = DltResource()
+    table = shard["table"]
+
+    print(f"Loading {shard['file_glob']} into {table} ({shard['write_disposition']})")
+    cursor = "timestamp" if shard["incremental"] else None
+    data = dlt_resource.read_csv_from_s3(
+        bucket=BUCKET,
+        file_glob=shard["file_glob"],
+        incremental_cursor=cursor,
+        columns=MOVIELENS_COLUMNS[table],
+        initial_value=dlt_resource.cursor_start(table, cursor) if cursor else None,
+    )
 
-    tags_data.apply_hints(primary_key=["userId", "movieId", "timestamp"])
+    data.apply_hints(primary_key=MOVIELENS_TABLES[table]["primary_key"])
 
     result = dlt_resource.run_pipeline(
-        tags_data, table_name="tags", write_disposition="replace"
+        data,
+        table_name=table,
+        write_disposition=shard["write_disposition"],
+        deferred_indexes=not shard["incremental"],
+        swap=False,
+        shard=shard["index"],
     )
+    result["file_glob"] = shard["file_glob"]
 
-    print(f"Tags pipeline completed: {result}")
+    print(f"Load of {shard['file_glob']} completed: {result}")
     return result
 
 
-def generate_summary(**context):
-    """Generate summary of all loaded MovieLens data."""
+def finalize_load(first, rest, **context):
+    """Swap in the tables replaced by this run and summarize the loads."""
     dlt_resource = DltResource()
+    replaced = context["ti"].xcom_pull(task_ids="discover_files", key="replaced")
+    results = [result for result in [*(first or []), *(rest or [])] if result]
 
-    print("Generating summary of MovieLens dataset...")
-
-    pipeline_names = ["movies", "ratings", "tags"]
-    schema_info = {}
-    tables_found = []
-
-    for table_name in pipeline_names:
-        try:
-            pipeline = dlt_resource.create_pipeline(table_name=table_name)
-
-            if pipeline.default_schema_name in pipeline.schemas:
-                schema = pipeline.schemas[pipeline.default_schema_name]
-                print(f"Found schema for pipeline '{pipeline.pipeline_name}'")
-                schema_info[table_name] = {
-                    "pipeline": pipeline.pipeline_name,
-                    "schema_version": schema.version,
+    tables: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        table = tables.setdefault(
+            result["table_name"], {"files": 0, "total_rows": 0, "constraints": []}
+        )
+        table["files"] += 1
+        table["total_rows"] += result.get("total_rows", 0)
+        if result.get("write_disposition") == "replace":
+            table["constraints"] = result.get("constraints", [])
+        if result.get("high_water_mark") is not None:
+            table["high_water_mark"] = str(result["high_water_mark"])
+
+    for table_name in replaced or []:
+        if table_name not in tables:
+            continue
+        seconds = dlt_resource.swap_in_bulk_table(
+            table_name, tables[table_name]["constraints"]
+        )
+        tables[table_name]["index_seconds"] = round(seconds, 3)
+        rows = tables[table_name]["total_rows"]
+        dlt_resource.publish_metrics(
+            f"{dlt_resource.pipeline_name}_{table_name}",
+            table_name,
+            {
+                "index": {
+                    "rows": rows,
+                    "seconds": round(seconds, 3),
+                    "rows_per_second": round(rows / seconds) if seconds > 0 else 0,
                 }
-                tables_found.extend(
-                    [t for t in schema.tables.keys() if t == table_name]
-                )
-        except Exception as e:
-            print(f"Could not get schema for {table_name}: {e}")
+            },
+        )
 
-    print(
-        f"Summary: Found {len(tables_found)} tables from {len(schema_info)} pipelines"
-    )
+    for table in tables.values():
+        del table["constraints"]
+
+    print(f"Summary: loaded {len(results)} files into {len(tables)} tables")
 
     return {
         "base_pipeline_name": dlt_resource.pipeline_name,
         "dataset_name": dlt_resource.dataset_name,
         "destination": dlt_resource.destination,
-        "pipelines_checked": list(schema_info.keys()),
-        "tables_found": tables_found,
-        "movielens_tables_count": len(tables_found),
-        "schema_info": schema_info,
+        "tables": tables,
+        "total_rows": sum(table["total_rows"] for table in tables.values()),
     }
 
 
@@ -305,32 +973,50 @@ dag = DAG(
     schedule=None,  # Manual trigger only
     catchup=False,
     tags=["etl", "movielens", "dlt"],
+    params={"mode": "full"},
+    max_active_tasks=MAX_ACTIVE_TASKS,
 )
 
 # Create tasks
-movies_task = PythonOperator(
-    task_id="process_movies",
-    python_callable=process_movies_table,
+discover_task = PythonOperator(
+    task_id="discover_files",
+    python_callable=discover_files,
     dag=dag,
 )
 
-ratings_task = PythonOperator(
-    task_id="process_ratings",
-    python_callable=process_ratings_table,
+appends_task = PythonOperator(
+    task_id="list_appends",
+    python_callable=list_appends,
     dag=dag,
 )
 
-tags_task = PythonOperator(
-    task_id="process_tags",
-    python_callable=process_tags_table,
+# One mapped task per planned load, spread over the workers
+load_first_task = PythonOperator.partial(
+    task_id="load_first_shards",
+    python_callable=load_shard,
+    pool=LOAD_POOL,
     dag=dag,
-)
+).expand(op_kwargs=discover_task.output)
 
-summary_task = PythonOperator(
-    task_id="generate_summary",
-    python_callable=generate_summary,
+load_rest_task = PythonOperator.partial(
+    task_id="load_shards",
+    python_callable=load_shard,
+    pool=LOAD_POOL,
+    dag=dag,
+).expand(op_kwargs=appends_task.output)
+
+finalize_task = PythonOperator(
+    task_id="finalize_load",
+    python_callable=finalize_load,
+    op_kwargs={
+        "first": load_first_task.output,
+        "rest": load_rest_task.output,
+    },
+    # Runs when either mapped task had nothing to load
+    trigger_rule="none_failed",
     dag=dag,
 )
 
 # Set task dependencies
-[movies_task, ratings_task, tags_task] >> summary_task
+discover_task >> appends_task
+discover_task >> load_first_task >> load_rest_task >> finalize_task
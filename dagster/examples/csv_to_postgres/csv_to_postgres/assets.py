@@ -1,6 +1,60 @@
-from dagster import AssetExecutionContext, MaterializeResult, MetadataValue, asset
-
-from .resources import DltResource
+from typing import Any, Dict
+
+from dagster import (
+    AssetExecutionContext,
+    Config,
+    MaterializeResult,
+    MetadataValue,
+    asset,
+)
+
+from .resources import EPOCH, DltResource
+
+# Declared MovieLens columns, in file order: ids fit in integer, ratings are
+# 0.5-5.0 stars and timestamps are Unix seconds
+MOVIELENS_COLUMNS = {
+    "movies": {"movieId": "INTEGER", "title": "VARCHAR", "genres": "VARCHAR"},
+    "ratings": {
+        "userId": "INTEGER",
+        "movieId": "INTEGER",
+        "rating": "FLOAT",
+        "timestamp": EPOCH,
+    },
+    "tags": {
+        "userId": "INTEGER",
+        "movieId": "INTEGER",
+        "tag": "VARCHAR",
+        "timestamp": EPOCH,
+    },
+}
+
+
+def stage_metadata(result: Dict[str, Any]) -> Dict[str, MetadataValue]:
+    """Return stage metrics as numeric metadata, which Dagster plots over runs."""
+    return {
+        f"{stage}_{measure}": MetadataValue.float(float(value))
+        for stage, metrics in result.get("stage_metrics", {}).items()
+        for measure, value in metrics.items()
+    }
+
+
+class LoadConfig(Config):
+    """Load mode for the ratings and tags assets.
+
+    - full: skip tables that already have data, otherwise replace them
+    - incremental: load only rows past the "timestamp" high-water mark kept in
+      the pipeline state
+    """
+
+    mode: str = "full"
+
+    @property
+    def incremental(self) -> bool:
+        if self.mode not in ("full", "incremental"):
+            raise ValueError(
+                f"Unknown mode '{self.mode}', expected 'full' or 'incremental'"
+            )
+        return self.mode == "incremental"
 
 
 @asset(group_name="movies")
@@ -24,7 +78,11 @@ def movies_pipeline(
 
     # Read movies CSV using dlt filesystem readers
     context.log.info("Reading movies.csv from MinIO...")
-    movies_data = dlt.read_csv_from_s3(bucket="movie-lens", file_glob="movies.csv")
+    movies_data = dlt.read_csv_from_s3(
+        bucket="movie-lens",
+        file_glob="movies.csv",
+        columns=MOVIELENS_COLUMNS["movies"],
+    )
 
     # Set primary key for movies table
     movies_data.apply_hints(primary_key="movieId")
@@ -33,6 +91,7 @@ def movies_pipeline(
         movies_data,
         table_name="movies",
         write_disposition="replace",
+        deferred_indexes=True,
     )
 
     context.log.info(f"Movies pipeline completed: {result}")
@@ -47,19 +106,30 @@ def movies_pipeline(
             "write_disposition": MetadataValue.text(
                 result.get("write_disposition", "")
             ),
+            "loader_file_format": MetadataValue.text(
+                result.get("loader_file_format", "")
+            ),
             "completed_jobs": MetadataValue.int(result.get("completed_jobs", 0)),
+            "total_rows": MetadataValue.int(result.get("total_rows", 0)),
+            "stage_metrics": MetadataValue.json(result.get("stage_metrics", {})),
+            **stage_metadata(result),
         }
     )
 
 
 @asset(group_name="ratings")
 def ratings_pipeline(
-    context: AssetExecutionContext, dlt: DltResource
+    context: AssetExecutionContext, dlt: DltResource, config: LoadConfig
 ) -> MaterializeResult:
-    """Load ratings CSV from MinIO to PostgreSQL using dlt."""
+    """Load ratings CSV from MinIO to PostgreSQL using dlt.
+
+    In incremental mode only ratings newer than the last run are merged.
+    """
+
+    incremental = config.incremental
 
     # Check if table already exists and has data
-    if dlt.table_exists_and_has_data("ratings"):
+    if not incremental and dlt.table_exists_and_has_data("ratings"):
         context.log.info("Ratings table already exists with data, skipping import")
         return MaterializeResult(
             metadata={
@@ -69,13 +139,22 @@ def ratings_pipeline(
         )
 
     # Read ratings CSV using dlt filesystem readers
-    ratings_data = dlt.read_csv_from_s3(bucket="movie-lens", file_glob="ratings.csv")
+    ratings_data = dlt.read_csv_from_s3(
+        bucket="movie-lens",
+        file_glob="ratings.csv",
+        incremental_cursor="timestamp" if incremental else None,
+        columns=MOVIELENS_COLUMNS["ratings"],
+        initial_value=dlt.cursor_start("ratings", "timestamp") if incremental else None,
+    )
 
     # Set composite primary key for ratings table
     ratings_data.apply_hints(primary_key=["userId", "movieId"])
 
     result = dlt.run_pipeline(
-        ratings_data, table_name="ratings", write_disposition="replace"
+        ratings_data,
+        table_name="ratings",
+        write_disposition="merge" if incremental else "replace",
+        deferred_indexes=not incremental,
     )
 
     context.log.info(f"Ratings pipeline completed: {result}")
@@ -90,19 +169,34 @@ def ratings_pipeline(
             "write_disposition": MetadataValue.text(
                 result.get("write_disposition", "")
             ),
+            "loader_file_format": MetadataValue.text(
+                result.get("loader_file_format", "")
+            ),
             "completed_jobs": MetadataValue.int(result.get("completed_jobs", 0)),
+            "total_rows": MetadataValue.int(result.get("total_rows", 0)),
+            "stage_metrics": MetadataValue.json(result.get("stage_metrics", {})),
+            **stage_metadata(result),
+            "mode": MetadataValue.text(config.mode),
+            "high_water_mark": MetadataValue.text(
+                str(result.get("high_water_mark") or "")
+            ),
         }
     )
 
 
 @asset(group_name="tags")
 def tags_pipeline(
-    context: AssetExecutionContext, dlt: DltResource
+    context: AssetExecutionContext, dlt: DltResource, config: LoadConfig
 ) -> MaterializeResult:
-    """Load tags CSV from MinIO to PostgreSQL using dlt."""
+    """Load tags CSV from MinIO to PostgreSQL using dlt.
+
+    In incremental mode only tags newer than the last run are appended.
+    """
+
+    incremental = config.incremental
 
     # Check if table already exists and has data
-    if dlt.table_exists_and_has_data("tags"):
+    if not incremental and dlt.table_exists_and_has_data("tags"):
         context.log.info("Tags table already exists with data, skipping import")
         return MaterializeResult(
             metadata={
@@ -112,12 +206,23 @@ def tags_pipeline(
         )
 
     # Read tags CSV using dlt filesystem readers
-    tags_data = dlt.read_csv_from_s3(bucket="movie-lens", file_glob="tags.csv")
+    tags_data = dlt.read_csv_from_s3(
+        bucket="movie-lens",
+        file_glob="tags.csv",
+        incremental_cursor="timestamp" if incremental else None,
+        columns=MOVIELENS_COLUMNS["tags"],
+        initial_value=dlt.cursor_start("tags", "timestamp") if incremental else None,
+    )
 
     # Set composite primary key for tags table
     tags_data.apply_hints(primary_key=["userId", "movieId", "timestamp"])
 
-    result = dlt.run_pipeline(tags_data, table_name="tags", write_disposition="replace")
+    result = dlt.run_pipeline(
+        tags_data,
+        table_name="tags",
+        write_disposition="merge" if incremental else "replace",
+        deferred_indexes=not incremental,
+    )
 
     context.log.info(f"Tags pipeline completed: {result}")
 
@@ -131,7 +236,17 @@ def tags_pipeline(
             "write_disposition": MetadataValue.text(
                 result.get("write_disposition", "")
             ),
+            "loader_file_format": MetadataValue.text(
+                result.get("loader_file_format", "")
+            ),
             "completed_jobs": MetadataValue.int(result.get("completed_jobs", 0)),
+            "total_rows": MetadataValue.int(result.get("total_rows", 0)),
+            "stage_metrics": MetadataValue.json(result.get("stage_metrics", {})),
+            **stage_metadata(result),
+            "mode": MetadataValue.text(config.mode),
+            "high_water_mark": MetadataValue.text(
+                str(result.get("high_water_mark") or "")
+            ),
         }
     )
 
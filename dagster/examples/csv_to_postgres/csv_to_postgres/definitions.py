@@ -1,3 +1,5 @@
+import os
+
 from dagster import Definitions, load_assets_from_modules
 
 from csv_to_postgres import assets  # noqa: TID252
@@ -8,6 +10,9 @@ all_assets = load_assets_from_modules([assets])
 defs = Definitions(
     assets=all_assets,
     resources={
-        "dlt": DltResource(),
+        "dlt": DltResource(
+            pipelines_dir=os.getenv("DLT_PIPELINES_DIR"),
+            pushgateway_url=os.getenv("PROMETHEUS_PUSHGATEWAY_URL"),
+        ),
     },
 )
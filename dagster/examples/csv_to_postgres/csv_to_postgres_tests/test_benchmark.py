@@ -0,0 +1,32 @@
+import json
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+)
+
+import benchmark_loads  # noqa: E402
+
+
+def test_benchmark_loads_duckdb(tmp_path):
+    output = tmp_path / "results.json"
+    benchmark_loads.main(
+        [
+            "--ratings",
+            "1k",
+            "--destination",
+            "duckdb",
+            "--workdir",
+            str(tmp_path),
+            "--output",
+            str(output),
+        ]
+    )
+
+    results = json.loads(output.read_text())
+    assert len(results) == 4
+    for result in results:
+        assert "error" not in result
+        assert result["rows"] == 1000
+        assert {"extract", "normalize", "load"} <= set(result["stages"])
@@ -11,3 +11,48 @@
 # Default: True
 # type:ignore
 c.IPKernelApp.capture_fd_output = False  # noqa: F821
+
+# Kernels started by buunstack.kernel_pool import these modules (comma-separated)
+# before reporting ready, so the first cell of a new notebook does not pay for them.
+# Modules are imported without binding names in the user namespace.
+import os  # noqa: E402
+
+_exec_lines = []
+_preload = [m for m in os.environ.get("BUUNSTACK_KERNEL_PRELOAD", "").split(",") if m]
+if _preload:
+    _exec_lines.append(
+        "def __buunstack_preload(modules):\n"
+        "    import importlib\n"
+        "    for module in modules:\n"
+        "        try:\n"
+        "            importlib.import_module(module)\n"
+        "        except Exception:\n"
+        "            pass\n"
+        f"__buunstack_preload({_preload!r})\n"
+        "del __buunstack_preload\n"
+    )
+
+# DuckDB sizes itself from the node, not the pod. The hub derives these variables from
+# the server's CPU and memory limits; apply them to DuckDB's default connection (used by
+# duckdb.sql() and friends). Connections opened with duckdb.connect() can pass
+# config={"memory_limit": os.environ["DUCKDB_MEMORY_LIMIT"], ...} themselves.
+_duckdb_settings = {
+    setting: os.environ[name]
+    for setting, name in (("memory_limit", "DUCKDB_MEMORY_LIMIT"), ("threads", "DUCKDB_THREADS"))
+    if os.environ.get(name)
+}
+if _duckdb_settings:
+    _exec_lines.append(
+        "def __buunstack_size_duckdb(settings):\n"
+        "    try:\n"
+        "        import duckdb\n"
+        "        for setting, value in settings.items():\n"
+        "            duckdb.execute(f\"SET {setting} = '{value}'\")\n"
+        "    except Exception:\n"
+        "        pass\n"
+        f"__buunstack_size_duckdb({_duckdb_settings!r})\n"
+        "del __buunstack_size_duckdb\n"
+    )
+
+if _exec_lines:
+    c.IPKernelApp.exec_lines = _exec_lines  # noqa: F821
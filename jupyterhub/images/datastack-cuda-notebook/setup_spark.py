@@ -7,10 +7,16 @@
 # - Required env variable: SPARK_HOME
 
 import argparse
+import hashlib
+import json
 import logging
 import os
 import re
+import shutil
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import requests
@@ -18,6 +24,15 @@ from bs4 import BeautifulSoup
 
 LOGGER = logging.getLogger(__name__)
 
+CHUNK_SIZE = 1024 * 1024
+# Don't split downloads into parts smaller than this
+MIN_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_RETRIES = 5
+REQUEST_TIMEOUT = 60
+# How long the cached list of Spark versions is trusted
+VERSION_INDEX_TTL = 24 * 60 * 60
+CONNECTORS_LOCKFILE = "connectors.lock.json"
+
 
 def get_all_refs(url: str) -> list[str]:
     """
@@ -28,15 +43,37 @@ def get_all_refs(url: str) -> list[str]:
     return [a["href"] for a in soup.find_all("a", href=True)]
 
 
-def get_latest_spark_version() -> str:
+def get_spark_versions(cache_dir: Path | None = None) -> list[str]:
     """
-    Returns the last version of Spark using spark archive
+    Returns the available Spark versions from the spark archive
+    The list is cached in cache_dir for VERSION_INDEX_TTL seconds
     """
+    index_file = cache_dir / "versions.json" if cache_dir else None
+    if index_file and index_file.exists():
+        index = json.loads(index_file.read_text())
+        if time.time() - index["fetched_at"] < VERSION_INDEX_TTL:
+            LOGGER.info(f"Using cached Spark versions from {index_file}")
+            return index["versions"]
+
     LOGGER.info("Downloading Spark versions information")
     all_refs = get_all_refs("https://archive.apache.org/dist/spark/")
     LOGGER.info(f"All refs: {all_refs}")
     pattern = re.compile(r"^spark-(\d+\.\d+\.\d+)/$")
     versions = [match.group(1) for ref in all_refs if (match := pattern.match(ref))]
+
+    if index_file:
+        write_atomic(
+            index_file,
+            json.dumps({"fetched_at": time.time(), "versions": versions}).encode(),
+        )
+    return versions
+
+
+def get_latest_spark_version(cache_dir: Path | None = None) -> str:
+    """
+    Returns the last version of Spark using spark archive
+    """
+    versions = get_spark_versions(cache_dir)
     LOGGER.info(f"Available versions: {versions}")
 
     # Compare versions semantically
@@ -54,15 +91,272 @@ def get_latest_spark_version() -> str:
     return latest_version
 
 
+def get_remote_size(url: str) -> tuple[str, int | None]:
+    """
+    Resolves redirects for url
+    Returns the final URL and its size, or None as size if byte ranges are not supported
+    """
+    resp = requests.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    resp.raise_for_status()
+    size = int(resp.headers.get("Content-Length", 0)) or None
+    if resp.headers.get("Accept-Ranges") != "bytes":
+        size = None
+    return resp.url, size
+
+
+def download_range(url: str, part: Path, start: int, end: int | None) -> None:
+    """
+    Downloads bytes start..end (inclusive) of url into part
+    Resumes from the data already in part; without an end the download restarts on retry
+    """
+    expected = None if end is None else end - start + 1
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        headers = {}
+        if expected is None:
+            part.unlink(missing_ok=True)
+        else:
+            done = part.stat().st_size if part.exists() else 0
+            if done == expected:
+                return
+            if done > expected:
+                part.unlink()
+                done = 0
+            headers["Range"] = f"bytes={start + done}-{end}"
+        try:
+            with requests.get(
+                url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT
+            ) as resp:
+                resp.raise_for_status()
+                if headers and resp.status_code != 206:
+                    raise requests.RequestException(
+                        f"Server ignored range request ({resp.status_code})"
+                    )
+                with part.open("ab") as f:
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+            if expected is None or part.stat().st_size == expected:
+                return
+            LOGGER.warning(f"{part.name} is incomplete, resuming")
+        except requests.RequestException as e:
+            LOGGER.warning(f"Downloading {part.name} failed (attempt {attempt}): {e}")
+            time.sleep(2**attempt)
+    raise RuntimeError(f"Failed to download {part.name} after {DOWNLOAD_RETRIES} attempts")
+
+
+def download_file(url: str, dest: Path, connections: int) -> str:
+    """
+    Downloads url to dest over several parallel ranged connections
+    Returns the SHA-512 hex digest of the downloaded file
+    """
+    url, size = get_remote_size(url)
+    if size is None:
+        LOGGER.info("Server does not support byte ranges, using a single connection")
+        ranges: list[tuple[int, int | None]] = [(0, None)]
+    else:
+        count = max(1, min(connections, size // MIN_PART_SIZE))
+        part_size = -(-size // count)
+        ranges = [
+            (start, min(start + part_size, size) - 1)
+            for start in range(0, size, part_size)
+        ]
+        LOGGER.info(f"Downloading {size} bytes over {len(ranges)} connections")
+
+    parts = [dest.with_name(f"{dest.name}.part{i}") for i in range(len(ranges))]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [
+            executor.submit(download_range, url, part, start, end)
+            for part, (start, end) in zip(parts, ranges)
+        ]
+        for future in futures:
+            future.result()
+
+    digest = hashlib.sha512()
+    with dest.open("wb") as out:
+        for part in parts:
+            with part.open("rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    out.write(chunk)
+            part.unlink()
+    return digest.hexdigest()
+
+
+def parse_sha512(text: str) -> str:
+    """
+    Parses a published .sha512 file
+    Apache releases use either `sha512sum` output (`<hex>  <file>`)
+    or `gpg --print-md` output (`<file>: <grouped upper-case hex>`)
+    """
+    if match := re.match(r"\s*([0-9a-fA-F]{128})\s", text + " "):
+        return match.group(1).lower()
+    _, _, digest = text.partition(":")
+    digest = "".join(digest.split()).lower()
+    if not re.fullmatch(r"[0-9a-f]{128}", digest):
+        raise ValueError(f"Unrecognized SHA-512 file: {text!r}")
+    return digest
+
+
+def fetch_sha512(url: str) -> str:
+    """
+    Returns the published SHA-512 digest for url
+    """
+    resp = requests.get(f"{url}.sha512", timeout=REQUEST_TIMEOUT)
+    resp.raise_for_status()
+    return parse_sha512(resp.text)
+
+
+def stream_extract(url: str, dest_dir: Path, expected_digest: str) -> Path:
+    """
+    Pipes the response for url straight into tar, hashing it on the way
+    Extracts into a staging directory inside dest_dir, which is returned once the
+    SHA-512 checksum has been verified and removed if anything fails
+    """
+    # pigz decompresses with separate read, write and check threads
+    decompressor = "pigz" if shutil.which("pigz") else "gzip"
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        staging = Path(tempfile.mkdtemp(prefix=".spark-staging-", dir=dest_dir))
+        digest = hashlib.sha512()
+        try:
+            with requests.get(url, stream=True, timeout=REQUEST_TIMEOUT) as resp:
+                resp.raise_for_status()
+                tar = subprocess.Popen(
+                    [
+                        "tar",
+                        "--extract",
+                        f"--use-compress-program={decompressor}",
+                        "-C",
+                        staging,
+                        "--owner",
+                        "root",
+                        "--group",
+                        "root",
+                        "--no-same-owner",
+                    ],
+                    stdin=subprocess.PIPE,
+                )
+                # tar keeps reading until its stdin is closed, so close it before
+                # waiting whatever happens, and kill tar if the stream broke off
+                streamed = False
+                try:
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        tar.stdin.write(chunk)
+                    streamed = True
+                except BrokenPipeError:
+                    # tar exited early, its return code says why
+                    streamed = True
+                finally:
+                    if not streamed:
+                        tar.kill()
+                    try:
+                        tar.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                    returncode = tar.wait()
+        except requests.RequestException as e:
+            shutil.rmtree(staging)
+            LOGGER.warning(f"Streaming {url} failed (attempt {attempt}): {e}")
+            time.sleep(2**attempt)
+            continue
+        except BaseException:
+            shutil.rmtree(staging)
+            raise
+
+        if returncode != 0:
+            shutil.rmtree(staging)
+            raise RuntimeError(f"tar exited with {returncode} while extracting {url}")
+        if digest.hexdigest() != expected_digest:
+            shutil.rmtree(staging)
+            raise RuntimeError(
+                f"SHA-512 mismatch for {url}: expected {expected_digest}, "
+                f"got {digest.hexdigest()}"
+            )
+        return staging
+    raise RuntimeError(f"Failed to stream {url} after {DOWNLOAD_RETRIES} attempts")
+
+
+def write_atomic(path: Path, content: bytes) -> None:
+    """
+    Writes content to path via a temporary file and rename
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(content)
+    tmp_path.replace(path)
+
+
+def file_sha512(path: Path) -> str:
+    """
+    Returns the SHA-512 hex digest of a file
+    """
+    digest = hashlib.sha512()
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Content-addressed artifact cache
+
+    Blobs are stored as sha512/<digest> and looked up by file name through
+    index/<name>, which holds the digest. A blob is re-hashed before use, so a
+    corrupted cache entry is dropped instead of being installed.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.blobs = root / "sha512"
+        self.index = root / "index"
+        self.downloads = root / "downloads"
+        for directory in (self.blobs, self.index, self.downloads):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def blob(self, digest: str) -> Path | None:
+        """
+        Returns the verified blob for digest, if cached
+        """
+        path = self.blobs / digest
+        if not path.exists():
+            return None
+        if file_sha512(path) != digest:
+            LOGGER.warning(f"Dropping corrupted cache entry {path}")
+            path.unlink()
+            return None
+        return path
+
+    def lookup(self, name: str) -> Path | None:
+        """
+        Returns the verified blob recorded for name, if cached
+        """
+        index_file = self.index / name
+        if not index_file.exists():
+            return None
+        return self.blob(index_file.read_text().strip())
+
+    def store(self, name: str, path: Path, digest: str) -> Path:
+        """
+        Moves a verified file into the cache and records it under name
+        """
+        blob = self.blobs / digest
+        path.replace(blob)
+        write_atomic(self.index / name, digest.encode())
+        return blob
+
+
 def download_spark(
     *,
     spark_version: str,
     hadoop_version: str,
     scala_version: str,
-    spark_download_url: Path,
+    spark_download_url: str,
+    download_connections: int,
+    cache_dir: Path | None = None,
+    stream: bool = False,
 ) -> str:
     """
-    Downloads and unpacks spark
+    Downloads, verifies and unpacks spark
     The resulting spark directory name is returned
     """
     LOGGER.info("Downloading and unpacking Spark")
@@ -70,18 +364,50 @@ def download_spark(
     if scala_version:
         spark_dir_name += f"-scala{scala_version}"
     LOGGER.info(f"Spark directory name: {spark_dir_name}")
-    spark_url = spark_download_url / f"spark-{spark_version}" / f"{spark_dir_name}.tgz"
+    spark_url = (
+        f"{spark_download_url.rstrip('/')}/spark-{spark_version}/{spark_dir_name}.tgz"
+    )
     LOGGER.info(f"Spark download URL: {spark_url}")
 
-    tmp_file = Path("/tmp/spark.tar.gz")
-    subprocess.check_call(
-        ["curl", "--progress-bar", "--location", "--output", tmp_file, spark_url]
-    )
+    artifact_name = f"{spark_dir_name}.tgz"
+    cache = ArtifactCache(cache_dir) if cache_dir else None
+    tarball = cache.lookup(artifact_name) if cache else None
+    if tarball:
+        LOGGER.info(f"Using cached Spark distribution {tarball}")
+    else:
+        expected_digest = fetch_sha512(spark_url)
+        tarball = cache.blob(expected_digest) if cache else None
+        if tarball:
+            # Same content cached under another name (e.g. a different mirror)
+            write_atomic(cache.index / artifact_name, expected_digest.encode())
+
+    if tarball is None and stream:
+        # Nothing touches the disk but the extracted files; the staging
+        # directory is only moved into place after the checksum matched
+        staging = stream_extract(spark_url, Path("/usr/local"), expected_digest)
+        LOGGER.info("SHA-512 checksum verified")
+        (staging / spark_dir_name).rename(Path("/usr/local") / spark_dir_name)
+        staging.rmdir()
+        return spark_dir_name
+
+    if tarball is None:
+        # Download parts inside the cache so an interrupted build resumes them
+        download_dir = cache.downloads if cache else Path("/tmp")
+        tmp_file = download_dir / artifact_name
+        digest = download_file(spark_url, tmp_file, download_connections)
+        if digest != expected_digest:
+            tmp_file.unlink()
+            raise RuntimeError(
+                f"SHA-512 mismatch for {spark_url}: expected {expected_digest}, got {digest}"
+            )
+        LOGGER.info("SHA-512 checksum verified")
+        tarball = cache.store(artifact_name, tmp_file, digest) if cache else tmp_file
+
     subprocess.check_call(
         [
             "tar",
             "xzf",
-            tmp_file,
+            tarball,
             "-C",
             "/usr/local",
             "--owner",
@@ -91,14 +417,196 @@ def download_spark(
             "--no-same-owner",
         ]
     )
-    tmp_file.unlink()
+    if not cache:
+        tarball.unlink()
     return spark_dir_name
 
 
+def file_sha1(path: Path) -> str:
+    """
+    Returns the SHA-1 hex digest of a file, as published by Maven repositories
+    """
+    digest = hashlib.sha1()
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_bundled_versions(jars_dir: Path) -> dict[str, str]:
+    """
+    Returns the Spark, Scala and Hadoop versions bundled with Spark,
+    read from the names of its JARs
+    """
+    versions = {}
+    for jar in jars_dir.iterdir():
+        if match := re.match(r"^spark-core_([^-]+)-(.+)\.jar$", jar.name):
+            versions["scala_binary_version"], versions["spark_version"] = match.groups()
+        elif match := re.match(r"^hadoop-client-api-(.+)\.jar$", jar.name):
+            versions["hadoop_version"] = match.group(1)
+    if len(versions) < 3:
+        raise RuntimeError(f"Cannot find the Spark and Hadoop JARs in {jars_dir}")
+    versions["spark_binary_version"] = ".".join(
+        versions["spark_version"].split(".")[:2]
+    )
+    return versions
+
+
+def get_aws_sdk_v2_version(
+    repository: str, hadoop_version: str, cache_dir: Path | None = None
+) -> str:
+    """
+    Returns the AWS SDK v2 version hadoop-aws is built against,
+    from the aws-java-sdk-v2.version property of the hadoop-project POM
+    Released POMs do not change, so the version is cached in cache_dir per Hadoop
+    version for good
+    """
+    index_file = cache_dir / "aws-sdk-v2-versions.json" if cache_dir else None
+    index = {}
+    if index_file and index_file.exists():
+        index = json.loads(index_file.read_text())
+    if hadoop_version in index:
+        LOGGER.info(f"Using cached AWS SDK v2 version for Hadoop {hadoop_version}")
+        return index[hadoop_version]
+
+    url = (
+        f"{repository}/org/apache/hadoop/hadoop-project/{hadoop_version}/"
+        f"hadoop-project-{hadoop_version}.pom"
+    )
+    resp = requests.get(url, timeout=REQUEST_TIMEOUT)
+    resp.raise_for_status()
+    match = re.search(r"<aws-java-sdk-v2\.version>([^<]+)<", resp.text)
+    if not match:
+        raise RuntimeError(f"No aws-java-sdk-v2.version in {url}")
+
+    if index_file:
+        index[hadoop_version] = match.group(1)
+        write_atomic(index_file, json.dumps(index).encode())
+    return match.group(1)
+
+
+def resolve_connectors(
+    config: dict, versions: dict[str, str], cache_dir: Path | None = None
+) -> list[dict[str, str]]:
+    """
+    Resolves the {spark_version}, {spark_binary_version}, {scala_binary_version},
+    {hadoop_version} and {aws_sdk_v2_version} placeholders in the artifacts and
+    versions of the manifest to the given versions of the installed Spark
+    """
+    repository = config.get("repository", "https://repo1.maven.org/maven2").rstrip("/")
+    versions = dict(versions)
+    if any("{aws_sdk_v2_version}" in c["version"] for c in config["connectors"]):
+        versions["aws_sdk_v2_version"] = get_aws_sdk_v2_version(
+            repository, versions["hadoop_version"], cache_dir
+        )
+
+    resolved = []
+    for connector in config["connectors"]:
+        try:
+            artifact = connector["artifact"].format_map(versions)
+            version = connector["version"].format_map(versions)
+        except KeyError as e:
+            raise RuntimeError(
+                f"Unknown placeholder {e} in connector {connector['artifact']}"
+            ) from None
+        group = connector["group"]
+        jar_name = f"{artifact}-{version}.jar"
+        resolved.append(
+            {
+                "group": group,
+                "artifact": artifact,
+                "version": version,
+                "jar_name": jar_name,
+                "url": f"{repository}/{group.replace('.', '/')}/{artifact}/"
+                f"{version}/{jar_name}",
+                "sha1": connector.get("sha1"),
+            }
+        )
+    return resolved
+
+
+def install_connectors(
+    *,
+    manifest: Path,
+    spark_home: Path,
+    download_connections: int,
+    cache_dir: Path | None = None,
+) -> None:
+    """
+    Fetches the connector JARs listed in manifest into ${SPARK_HOME}/jars
+    Each JAR is verified against the SHA-1 pinned in the manifest or published
+    next to it, and recorded with its checksums in ${SPARK_HOME}/connectors.lock.json
+    Fails before installing anything if a connector is not published for the
+    installed Spark, Scala and Hadoop versions
+    """
+    LOGGER.info(f"Installing Spark connectors from {manifest}")
+    jars_dir = spark_home / "jars"
+    versions = get_bundled_versions(jars_dir)
+    connectors = resolve_connectors(
+        json.loads(manifest.read_text()), versions, cache_dir
+    )
+    cache = ArtifactCache(cache_dir) if cache_dir else None
+
+    for connector in connectors:
+        if connector["sha1"] or (cache and cache.lookup(connector["jar_name"])):
+            continue
+        resp = requests.get(f"{connector['url']}.sha1", timeout=REQUEST_TIMEOUT)
+        if resp.status_code == 404:
+            raise RuntimeError(
+                f"{connector['group']}:{connector['artifact']}:{connector['version']} "
+                f"is not published, update {manifest} for Spark "
+                f"{versions['spark_version']} (Scala {versions['scala_binary_version']}, "
+                f"Hadoop {versions['hadoop_version']})"
+            )
+        resp.raise_for_status()
+        connector["sha1"] = resp.text.split()[0].lower()
+
+    locked = []
+    for connector in connectors:
+        jar_name, url = connector["jar_name"], connector["url"]
+        jar = cache.lookup(jar_name) if cache else None
+        if jar is None:
+            download_dir = cache.downloads if cache else Path("/tmp")
+            tmp_file = download_dir / jar_name
+            sha512 = download_file(url, tmp_file, download_connections)
+            jar = cache.store(jar_name, tmp_file, sha512) if cache else tmp_file
+        else:
+            LOGGER.info(f"Using cached {jar_name}")
+            sha512 = jar.name
+
+        sha1 = file_sha1(jar)
+        expected_sha1 = connector["sha1"]
+        if expected_sha1 and sha1 != expected_sha1:
+            jar.unlink()
+            raise RuntimeError(
+                f"SHA-1 mismatch for {url}: expected {expected_sha1}, got {sha1}"
+            )
+        shutil.copyfile(jar, jars_dir / jar_name)
+        if not cache:
+            jar.unlink()
+        group, artifact, version = (connector[k] for k in ("group", "artifact", "version"))
+        LOGGER.info(f"Installed {group}:{artifact}:{version}")
+        locked.append(
+            {
+                "group": group,
+                "artifact": artifact,
+                "version": version,
+                "url": url,
+                "sha1": sha1,
+                "sha512": sha512,
+            }
+        )
+
+    lockfile = spark_home / CONNECTORS_LOCKFILE
+    lockfile.write_text(json.dumps({"connectors": locked}, indent=2) + "\n")
+    LOGGER.info(f"Recorded {len(locked)} connectors in {lockfile}")
+
+
 def configure_spark(spark_dir_name: str, spark_home: Path) -> None:
     """
     Creates a ${SPARK_HOME} symlink to a versioned spark directory
     Creates a 10spark-config.sh symlink to source PYTHONPATH automatically
+    Creates a 20spark-defaults.py symlink to size spark-defaults.conf at startup
     """
     LOGGER.info("Configuring Spark")
     subprocess.check_call(["ln", "-s", f"/usr/local/{spark_dir_name}", spark_home])
@@ -109,6 +617,12 @@ def configure_spark(spark_dir_name: str, spark_home: Path) -> None:
         ["ln", "-s", spark_home / "sbin/spark-config.sh", CONFIG_SCRIPT]
     )
 
+    # Generate spark-defaults.conf from the container limits on every start
+    DEFAULTS_SCRIPT = "/usr/local/bin/before-notebook.d/20spark-defaults.py"
+    subprocess.check_call(
+        ["ln", "-s", Path(__file__).parent / "spark_defaults.py", DEFAULTS_SCRIPT]
+    )
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -117,17 +631,49 @@ if __name__ == "__main__":
     arg_parser.add_argument("--spark-version", required=True)
     arg_parser.add_argument("--hadoop-version", required=True)
     arg_parser.add_argument("--scala-version", required=True)
-    arg_parser.add_argument("--spark-download-url", type=Path, required=True)
+    arg_parser.add_argument("--spark-download-url", required=True)
+    arg_parser.add_argument(
+        "--download-connections",
+        type=int,
+        default=8,
+        help="Number of parallel connections used to download Spark",
+    )
+    arg_parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Content-addressed cache for Spark distributions and the version index",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Extract while downloading instead of going through a temporary file "
+        "(cached tarballs are still used, but new downloads are not cached)",
+    )
+    arg_parser.add_argument(
+        "--connector-manifest",
+        type=Path,
+        help="JSON manifest of connector JARs to install into ${SPARK_HOME}/jars",
+    )
     args = arg_parser.parse_args()
 
-    args.spark_version = args.spark_version or get_latest_spark_version()
+    args.spark_version = args.spark_version or get_latest_spark_version(args.cache_dir)
 
     spark_dir_name = download_spark(
         spark_version=args.spark_version,
         hadoop_version=args.hadoop_version,
         scala_version=args.scala_version,
         spark_download_url=args.spark_download_url,
+        download_connections=args.download_connections,
+        cache_dir=args.cache_dir,
+        stream=args.stream,
     )
     configure_spark(
         spark_dir_name=spark_dir_name, spark_home=Path(os.environ["SPARK_HOME"])
     )
+    if args.connector_manifest:
+        install_connectors(
+            manifest=args.connector_manifest,
+            spark_home=Path(os.environ["SPARK_HOME"]),
+            download_connections=args.download_connections,
+            cache_dir=args.cache_dir,
+        )
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Writes ${SPARK_HOME}/conf/spark-defaults.conf sized to the container
+#
+# Runs as a before-notebook.d hook on every server start, so the settings
+# follow the CPU and memory limits of the pod rather than those of the node.
+# Settings in ~/.spark/spark-defaults.conf take precedence over generated ones.
+# Set SPARK_DEFAULTS_DISABLED=true to leave spark-defaults.conf untouched.
+
+import logging
+import math
+import os
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+# Share of the container memory given to the driver JVM; the rest is left to
+# the Python kernel (pandas, Arrow conversion buffers)
+DRIVER_MEMORY_FRACTION = 0.5
+MIN_DRIVER_MEMORY_MB = 512
+# Initial shuffle partitions per core; adaptive execution coalesces them
+SHUFFLE_PARTITIONS_PER_CORE = 2
+# cgroup v1 reports "no limit" as a huge number
+UNLIMITED_MEMORY = 1 << 60
+
+USER_DEFAULTS = Path.home() / ".spark" / "spark-defaults.conf"
+
+
+def read_file(path: str) -> str | None:
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def float_env(name: str) -> float | None:
+    try:
+        return float(os.environ[name]) or None
+    except (KeyError, ValueError):
+        return None
+
+
+def detect_cpu_limit() -> float:
+    """
+    Returns the container CPU limit in cores
+    cgroup v2, then cgroup v1, then CPU_LIMIT set by JupyterHub, then the CPU count
+    """
+    if cpu_max := read_file("/sys/fs/cgroup/cpu.max"):
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max":
+            return int(quota) / int(period or 100000)
+    quota = read_file("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = read_file("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return float_env("CPU_LIMIT") or float(os.cpu_count() or 1)
+
+
+def detect_memory_limit() -> int:
+    """
+    Returns the container memory limit in bytes
+    cgroup v2, then cgroup v1, then MEM_LIMIT set by JupyterHub, then physical memory
+    """
+    memory_max = read_file("/sys/fs/cgroup/memory.max")
+    if memory_max and memory_max != "max":
+        return int(memory_max)
+    limit = read_file("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if limit and int(limit) < UNLIMITED_MEMORY:
+        return int(limit)
+    if mem_limit := float_env("MEM_LIMIT"):
+        return int(mem_limit)
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def generate_defaults(cpu_limit: float, memory_limit: int) -> dict[str, str]:
+    """
+    Returns Spark settings for a local-mode driver with the given resources
+    """
+    cores = max(1, math.floor(cpu_limit))
+    driver_memory_mb = max(
+        MIN_DRIVER_MEMORY_MB, int(memory_limit * DRIVER_MEMORY_FRACTION / MiB)
+    )
+    partitions = max(2, cores * SHUFFLE_PARTITIONS_PER_CORE)
+    return {
+        "spark.master": f"local[{cores}]",
+        "spark.driver.cores": str(cores),
+        "spark.driver.memory": f"{driver_memory_mb}m",
+        "spark.driver.maxResultSize": f"{max(256, driver_memory_mb // 4)}m",
+        "spark.default.parallelism": str(partitions),
+        "spark.sql.shuffle.partitions": str(partitions),
+        # Arrow-based conversion between Spark and pandas
+        "spark.sql.execution.arrow.pyspark.enabled": "true",
+        "spark.sql.execution.arrow.pyspark.fallback.enabled": "true",
+        # Adaptive query execution
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.minPartitionNum": str(cores),
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": "64m",
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.adaptive.localShuffleReader.enabled": "true",
+    }
+
+
+def parse_defaults(text: str) -> dict[str, str]:
+    """
+    Parses spark-defaults.conf content (`key value` per line, # comments)
+    """
+    settings = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        key, *value = line.split(None, 1)
+        if "=" in key and not value:
+            key, *value = key.split("=", 1)
+        settings[key.strip()] = value[0].strip() if value else ""
+    return settings
+
+
+def write_defaults(conf_dir: Path) -> None:
+    cpu_limit = detect_cpu_limit()
+    memory_limit = detect_memory_limit()
+    settings = generate_defaults(cpu_limit, memory_limit)
+    LOGGER.info(
+        f"Spark defaults for {cpu_limit:g} CPUs and {memory_limit // MiB} MiB: "
+        f"driver {settings['spark.driver.memory']}, {settings['spark.master']}"
+    )
+
+    overrides = {}
+    if USER_DEFAULTS.exists():
+        overrides = parse_defaults(USER_DEFAULTS.read_text())
+        LOGGER.info(f"Applying {len(overrides)} settings from {USER_DEFAULTS}")
+    settings.update(overrides)
+
+    lines = [
+        "# Generated at server start by spark_defaults.py from the container limits",
+        f"# (CPU: {cpu_limit:g}, memory: {memory_limit // MiB} MiB).",
+        f"# Do not edit; put your own settings in {USER_DEFAULTS} instead.",
+        "",
+    ]
+    lines += [f"{key} {value}" for key, value in settings.items()]
+    conf_file = conf_dir / "spark-defaults.conf"
+    tmp_file = conf_dir / ".spark-defaults.conf.tmp"
+    tmp_file.write_text("\n".join(lines) + "\n")
+    tmp_file.replace(conf_file)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="spark_defaults: %(message)s")
+
+    if os.environ.get("SPARK_DEFAULTS_DISABLED", "false") == "true":
+        LOGGER.info("SPARK_DEFAULTS_DISABLED is set, skipping")
+    else:
+        write_defaults(Path(os.environ["SPARK_HOME"]) / "conf")
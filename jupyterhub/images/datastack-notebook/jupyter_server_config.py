@@ -0,0 +1,16 @@
+# Jupyter Server configuration for buun-stack notebook servers
+#
+# Loaded in addition to the docker-stacks configuration in /etc/jupyter.
+
+import os
+
+# Pre-warmed kernel pool (buunstack.kernel_pool), opt-in with KERNEL_POOL_ENABLED=true
+# KERNEL_POOL_SIZE: number of warm kernels, sized to the server's CPU and memory if unset
+# KERNEL_POOL_PRELOAD: comma-separated modules the warm kernels import
+if os.environ.get("KERNEL_POOL_ENABLED", "false") == "true":
+    c.ServerApp.kernel_manager_class = "buunstack.kernel_pool.PooledKernelManager"  # noqa: F821
+    c.ServerApp.jpserver_extensions.update({"buunstack.kernel_pool": True})  # noqa: F821
+    if os.environ.get("KERNEL_POOL_SIZE"):
+        c.PooledKernelManager.pool_size = int(os.environ["KERNEL_POOL_SIZE"])  # noqa: F821
+    if os.environ.get("KERNEL_POOL_PRELOAD"):
+        c.PooledKernelManager.preload_modules = os.environ["KERNEL_POOL_PRELOAD"].split(",")  # noqa: F821
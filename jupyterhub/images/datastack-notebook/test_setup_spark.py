@@ -0,0 +1,135 @@
+import hashlib
+import io
+import json
+import tarfile
+from pathlib import Path
+
+import pytest
+import requests
+
+import setup_spark
+
+
+def make_tarball() -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        content = b"spark" * 1024
+        info = tarfile.TarInfo("spark-4.0.1-bin-hadoop3/RELEASE")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, fail_after: int | None = None):
+        self.body = body
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), 64):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError("connection reset")
+            yield self.body[start : start + 64]
+
+
+def test_stream_extract_retries_a_broken_stream(tmp_path, monkeypatch):
+    tarball = make_tarball()
+    responses = [FakeResponse(tarball, fail_after=128), FakeResponse(tarball)]
+    monkeypatch.setattr(setup_spark.requests, "get", lambda *a, **kw: responses.pop(0))
+    monkeypatch.setattr(setup_spark.time, "sleep", lambda seconds: None)
+
+    staging = setup_spark.stream_extract(
+        "https://example.com/spark.tgz",
+        tmp_path,
+        hashlib.sha512(tarball).hexdigest(),
+    )
+
+    assert responses == []
+    assert (staging / "spark-4.0.1-bin-hadoop3" / "RELEASE").read_bytes() == (
+        b"spark" * 1024
+    )
+    assert list(tmp_path.iterdir()) == [staging]
+
+
+def test_stream_extract_gives_up_after_retries(tmp_path, monkeypatch):
+    tarball = make_tarball()
+    monkeypatch.setattr(
+        setup_spark.requests,
+        "get",
+        lambda *a, **kw: FakeResponse(tarball, fail_after=128),
+    )
+    monkeypatch.setattr(setup_spark.time, "sleep", lambda seconds: None)
+
+    with pytest.raises(RuntimeError, match="Failed to stream"):
+        setup_spark.stream_extract(
+            "https://example.com/spark.tgz",
+            tmp_path,
+            hashlib.sha512(tarball).hexdigest(),
+        )
+    assert list(tmp_path.iterdir()) == []
+
+
+class FakeMaven:
+    """Serves the hadoop-project POM and connector JARs with their .sha1 files"""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, timeout=None, **kwargs):
+        self.requests.append(url)
+        if url.endswith(".pom"):
+            body = "<aws-java-sdk-v2.version>2.24.6</aws-java-sdk-v2.version>"
+        else:
+            body = hashlib.sha1(url.removesuffix(".sha1").encode()).hexdigest()
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body.encode()
+        return response
+
+    def download_file(self, url, dest, connections):
+        self.requests.append(url)
+        dest.write_bytes(url.encode())
+        return hashlib.sha512(url.encode()).hexdigest()
+
+
+def test_install_connectors_rebuilds_from_cache_offline(tmp_path, monkeypatch):
+    maven = FakeMaven()
+    monkeypatch.setattr(setup_spark.requests, "get", maven.get)
+    monkeypatch.setattr(setup_spark, "download_file", maven.download_file)
+    manifest = Path(setup_spark.__file__).with_name("spark-connectors.json")
+
+    def install(build):
+        spark_home = tmp_path / build
+        (spark_home / "jars").mkdir(parents=True)
+        for jar in ("spark-core_2.13-4.0.1.jar", "hadoop-client-api-3.4.1.jar"):
+            (spark_home / "jars" / jar).touch()
+        setup_spark.install_connectors(
+            manifest=manifest,
+            spark_home=spark_home,
+            download_connections=1,
+            cache_dir=tmp_path / "cache",
+        )
+        return json.loads((spark_home / "connectors.lock.json").read_text())
+
+    first = install("first")
+    assert any(url.endswith("hadoop-project-3.4.1.pom") for url in maven.requests)
+    jars = {c["url"].rsplit("/", 1)[1] for c in first["connectors"]}
+    assert {
+        "hadoop-aws-3.4.1.jar",
+        "bundle-2.24.6.jar",
+        "iceberg-spark-runtime-4.0_2.13-1.11.0.jar",
+        "iceberg-aws-bundle-1.11.0.jar",
+    } <= jars
+
+    maven.requests.clear()
+    assert install("rebuild") == first
+    assert maven.requests == []
@@ -34,6 +34,12 @@ path "auth/token/renew-self" {
   capabilities = ["update"]
 }
 
+# Revoke notebook tokens when servers stop and sweep orphaned ones
+# (their accessors are indexed under secret/data/jupyter/hub/)
+path "auth/token/revoke-accessor" {
+  capabilities = ["update"]
+}
+
 # Create user-specific policies dynamically (new API)
 path "sys/policies/acl/jupyter-user-*" {
   capabilities = ["create", "read", "update", "delete"]
@@ -1,10 +1,77 @@
 # JupyterHub pre_spawn_hook
 # Sets up user environment and creates user-specific Vault tokens
 
+import asyncio
+import fnmatch
 import hvac
+import json
+import math
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from jupyterhub.services.auth import HubAuth
+from jupyterhub.utils import new_token
+from kubernetes_asyncio.client.models import V1EnvVar
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.parser import text_string_to_metric_families
+from tornado import web
+from tornado.escape import url_escape
+from tornado.httpclient import AsyncHTTPClient
+from tornado.log import app_log
 
 {{- if eq .Env.JUPYTERHUB_VAULT_INTEGRATION_ENABLED "true" }}
+# Per-step latency of the Vault work in pre_spawn_hook.
+# Registered in the default registry, so it is exported by the hub's /hub/metrics
+# endpoint that jupyterhub-servicemonitor already scrapes.
+PRE_SPAWN_STEP_DURATION = Histogram(
+    "jupyterhub_pre_spawn_hook_step_duration_seconds",
+    "Time spent in each Vault step of pre_spawn_hook",
+    ["step", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+@contextmanager
+def observe_step(step):
+    """Record the duration of a pre_spawn_hook step, labelled with success or failure"""
+    status = "failure"
+    start = time.perf_counter()
+    try:
+        yield
+        status = "success"
+    finally:
+        PRE_SPAWN_STEP_DURATION.labels(step=step, status=status).observe(
+            time.perf_counter() - start
+        )
+
+
+class RenewerMetricsCollector:
+    """Re-export the metrics written by the vault-token-renewer sidecar
+
+    The sidecar writes Prometheus text format to the shared /vault/secrets
+    volume, so its metrics are scraped together with the hub's.
+    """
+
+    metrics_file = "/vault/secrets/renewer.prom"
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        try:
+            with open(self.metrics_file) as f:
+                text = f.read()
+        except OSError:
+            return
+        yield from text_string_to_metric_families(text)
+
+
+REGISTRY.register(RenewerMetricsCollector())
+
+
 def get_vault_token():
     """Read Vault token from file"""
     token_file = '/vault/secrets/vault-token'
@@ -19,87 +86,590 @@ def get_vault_token():
         print(f"Error reading token file {token_file}: {e}")
 
     return None
+
+
+def get_admin_vault_client():
+    """Create a Vault client authenticated with the hub's admin token"""
+    vault_token = get_vault_token()
+    if not vault_token:
+        raise Exception("No Vault token available from file or environment")
+    vault_client = hvac.Client(
+        url=os.environ.get("VAULT_ADDR", "{{ .Env.VAULT_ADDR }}"), verify=False
+    )
+    vault_client.token = vault_token
+    return vault_client
+
+
+def issue_notebook_token(vault_client, username, server_key, log):
+    """Create the user-specific policy and a renewable orphan token for a notebook server
+
+    The token is recorded in the token index under server_key ("<user>/<server>").
+    """
+    user_policy_name = "jupyter-user-{}".format(username)
+
+    # Read policy template from file
+    policy_template_path = "/srv/jupyterhub/user_policy.hcl"
+    with open(policy_template_path, 'r') as f:
+        policy_template = f.read()
+
+    # Replace {username} placeholder with actual username
+    user_policy = policy_template.replace("{username}", username)
+
+    # Write user-specific policy
+    try:
+        with observe_step("policy_write"):
+            vault_client.sys.create_or_update_policy(user_policy_name, user_policy)
+        log.info("✅ Created policy: {}".format(user_policy_name))
+    except Exception as policy_e:
+        log.warning("Policy creation failed (may already exist): {}".format(policy_e))
+
+    # Get TTL settings from environment variables
+    user_token_ttl = os.environ.get("NOTEBOOK_VAULT_TOKEN_TTL", "24h")
+    user_token_max_ttl = os.environ.get("NOTEBOOK_VAULT_TOKEN_MAX_TTL", "168h")
+
+    with observe_step("orphan_token_create"):
+        token_response = vault_client.auth.token.create_orphan(
+            policies=[user_policy_name],
+            ttl=user_token_ttl,
+            renewable=True,
+            display_name="notebook-{}".format(username),
+            explicit_max_ttl=user_token_max_ttl,
+            meta={"jupyterhub_server": server_key},
+        )
+    token_auth = token_response["auth"]
+
+    try:
+        with observe_step("token_index_write"):
+            update_token_index(
+                vault_client,
+                {token_auth["accessor"]: {"server": server_key, "issued_at": time.time()}},
+            )
+    except Exception as index_e:
+        log.warning("Token of {} not indexed, it is only revoked by expiry: {}".format(server_key, index_e))
+
+    return token_auth
+
+
+# Notebook token revocation
+# Every spawn creates a renewable orphan token. Revoking it when the server stops
+# (and periodically sweeping tokens whose server is gone) keeps Vault's token store
+# and lease expiration work proportional to running servers, not to spawn history.
+REVOKE_ON_STOP = os.environ.get("NOTEBOOK_VAULT_TOKEN_REVOKE_ON_STOP", "true") == "true"
+SWEEP_INTERVAL = int(os.environ.get("NOTEBOOK_VAULT_TOKEN_SWEEP_INTERVAL", "3600"))
+# Tokens younger than this are never swept, so in-flight spawns are left alone
+SWEEP_GRACE_PERIOD = 600
+REVOKE_BATCH_SIZE = 50
+# Revocation requests in flight at once
+REVOKE_CONCURRENCY = 8
+HUB_API_URL = "http://127.0.0.1:8081/hub/api"
+# Index of the notebook tokens the hub issued: accessor -> {"server", "issued_at"}.
+# Kept in Vault under a path only the hub can read, so it survives hub restarts, and
+# revocation only looks at these tokens rather than at every token in Vault.
+TOKEN_INDEX_PATH = "jupyter/hub/notebook-tokens"
+
+NOTEBOOK_TOKENS_REVOKED = Counter(
+    "jupyterhub_notebook_vault_tokens_revoked_total",
+    "Notebook Vault tokens revoked by the hub",
+    ["source", "status"],
+)
+
+# Servers stopped since the last revocation batch, as (spawner key, stopped at)
+revocation_queue = asyncio.Queue()
+background_tasks = set()
+
+
+def spawner_key(spawner):
+    return "{}/{}".format(spawner.user.name, spawner.name)
+
+
+def update_token_index(vault_client, entries):
+    """Merge entries into the token index, None removing an accessor (blocking)
+
+    Sent as a JSON merge patch, which Vault applies atomically, so concurrent spawns
+    and revocations do not overwrite each other's entries.
+    """
+    def patch():
+        vault_client.adapter.request(
+            "PATCH",
+            "/v1/secret/data/{}".format(TOKEN_INDEX_PATH),
+            json={"data": entries},
+            headers={"Content-Type": "application/merge-patch+json"},
+        )
+
+    try:
+        patch()
+    except hvac.exceptions.InvalidPath:
+        added = {accessor: entry for accessor, entry in entries.items() if entry is not None}
+        if not added:
+            return
+        try:
+            # Create the index, unless a concurrent spawn just did
+            vault_client.secrets.kv.v2.create_or_update_secret(
+                path=TOKEN_INDEX_PATH, secret=added, cas=0, mount_point="secret"
+            )
+        except hvac.exceptions.InvalidRequest:
+            patch()
+
+
+def read_token_index(vault_client):
+    """Return the token index, accessor -> {"server", "issued_at"} (blocking)"""
+    try:
+        response = vault_client.secrets.kv.v2.read_secret_version(
+            path=TOKEN_INDEX_PATH, mount_point="secret", raise_on_deleted_version=False
+        )
+    except hvac.exceptions.InvalidPath:
+        return {}
+    return response["data"]["data"] or {}
+
+
+def revoke_accessor(vault_client, accessor, source):
+    """Revoke a notebook token by accessor, returning whether it is gone (blocking)"""
+    try:
+        vault_client.auth.token.revoke_accessor(accessor)
+    except hvac.exceptions.InvalidRequest:
+        # Already expired or revoked
+        pass
+    except Exception as e:
+        NOTEBOOK_TOKENS_REVOKED.labels(source=source, status="failure").inc()
+        print(f"Failed to revoke notebook token accessor {accessor}: {e}")
+        return False
+    NOTEBOOK_TOKENS_REVOKED.labels(source=source, status="success").inc()
+    return True
+
+
+def revoke_accessors(vault_client, accessors, source):
+    """Revoke notebook tokens concurrently and drop them from the index (blocking)"""
+    if not accessors:
+        return
+    with ThreadPoolExecutor(max_workers=REVOKE_CONCURRENCY) as executor:
+        revoked = list(
+            executor.map(lambda accessor: revoke_accessor(vault_client, accessor, source), accessors)
+        )
+    gone = [accessor for accessor, ok in zip(accessors, revoked) if ok]
+    if gone:
+        update_token_index(vault_client, dict.fromkeys(gone))
+
+
+def revoke_stopped_servers(stopped):
+    """Revoke the indexed tokens issued to servers before they stopped (blocking)"""
+    # A server restarted since is queued again, and keeps the tokens of its new spawn
+    stopped_at = dict(stopped)
+    vault_client = get_admin_vault_client()
+    accessors = [
+        accessor
+        for accessor, entry in read_token_index(vault_client).items()
+        if entry.get("server") in stopped_at
+        and entry.get("issued_at", 0) <= stopped_at[entry["server"]]
+    ]
+    revoke_accessors(vault_client, accessors, "stop")
+
+
+async def revoke_tokens_worker():
+    """Drain the revocation queue in batches without blocking the hub event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await revocation_queue.get()]
+        while len(batch) < REVOKE_BATCH_SIZE and not revocation_queue.empty():
+            batch.append(revocation_queue.get_nowait())
+        try:
+            await loop.run_in_executor(None, revoke_stopped_servers, batch)
+        except Exception as e:
+            print(f"Failed to revoke notebook tokens of {len(batch)} stopped servers: {e}")
+
+
+def get_active_servers():
+    """Return ready or pending servers from the hub API, key -> pending (blocking)"""
+    admin_service_token = os.environ.get("JUPYTERHUB_ADMIN_SERVICE_TOKEN", "")
+    headers = {
+        "Authorization": f"token {admin_service_token}",
+        "Accept": "application/jupyterhub-pagination+json",
+    }
+    servers = {}
+    offset = 0
+    while True:
+        response = requests.get(
+            f"{HUB_API_URL}/users",
+            params={"state": "active", "offset": offset, "limit": 200},
+            headers=headers,
+            timeout=30,
+        )
+        response.raise_for_status()
+        page = response.json()
+        for user in page["items"]:
+            for name, server in (user.get("servers") or {}).items():
+                servers["{}/{}".format(user["name"], name)] = server.get("pending")
+        next_page = page["_pagination"].get("next")
+        if not next_page:
+            return servers
+        offset = next_page["offset"]
+
+
+def sweep_orphaned_tokens():
+    """Revoke indexed notebook tokens whose server is not running (blocking)
+
+    Returns the number of tokens revoked, or None if the sweep was skipped.
+    """
+    active_servers = get_active_servers()
+    if "check" in active_servers.values():
+        # After a restart the hub polls the servers it restored from its database;
+        # until then their tokens cannot be told from orphaned ones
+        print("Hub is still checking its servers, skipping notebook token sweep")
+        return None
+
+    vault_client = get_admin_vault_client()
+    now = time.time()
+    orphaned = [
+        accessor
+        for accessor, entry in read_token_index(vault_client).items()
+        if entry.get("server") not in active_servers
+        and now - entry.get("issued_at", now) >= SWEEP_GRACE_PERIOD
+    ]
+    revoke_accessors(vault_client, orphaned, "sweep")
+    return len(orphaned)
+
+
+async def sweep_tokens_worker():
+    """Periodically revoke orphaned notebook tokens"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            revoked = await loop.run_in_executor(None, sweep_orphaned_tokens)
+            if revoked is not None:
+                print(f"Notebook token sweep revoked {revoked} orphaned tokens")
+        except Exception as e:
+            print(f"Notebook token sweep failed: {e}")
+
+
+# Environment secret injection
+# Merges the user's jupyter/users/<user>/environment secret into the spawner environment,
+# so kernels start with it set instead of each reading it from Vault.
+ENV_INJECTION_ENABLED = os.environ.get("NOTEBOOK_ENV_INJECTION_ENABLED", "false") == "true"
+ENV_INJECTION_ALLOWLIST = [
+    pattern.strip()
+    for pattern in os.environ.get("NOTEBOOK_ENV_INJECTION_ALLOWLIST", "*").split(",")
+    if pattern.strip()
+]
+ENV_INJECTION_MAX_BYTES = int(os.environ.get("NOTEBOOK_ENV_INJECTION_MAX_BYTES", "65536"))
+ENV_INJECTION_SECRET_KEY = "environment"
+
+
+def inject_user_environment(spawner, vault_client):
+    """Merge allowlisted variables of the user's environment secret into spawner.environment"""
+    username = spawner.user.name
+
+    # The spawner (and its environment) is reused across restarts: drop what the
+    # previous spawn injected so deleted variables do not linger
+    for name in spawner.environment.pop("BUUNSTACK_INJECTED_ENV", "").split(","):
+        spawner.environment.pop(name, None)
+
+    with observe_step("env_secret_read"):
+        try:
+            response = vault_client.secrets.kv.v2.read_secret_version(
+                path="jupyter/users/{}/{}".format(username, ENV_INJECTION_SECRET_KEY),
+                mount_point="secret",
+                raise_on_deleted_version=False,
+            )
+            env_vars = response["data"]["data"] or {}
+        except hvac.exceptions.InvalidPath:
+            env_vars = {}
+
+    injected = {}
+    for name, value in env_vars.items():
+        # Never override variables set by the hub (Vault token, API URLs, ...)
+        if name in spawner.environment or name.startswith("JUPYTERHUB_"):
+            spawner.log.warning("Skipping reserved environment variable {} for {}".format(name, username))
+            continue
+        if not any(fnmatch.fnmatchcase(name, pattern) for pattern in ENV_INJECTION_ALLOWLIST):
+            continue
+        injected[name] = str(value)
+
+    size = sum(len(name) + len(value) for name, value in injected.items())
+    if size > ENV_INJECTION_MAX_BYTES:
+        spawner.log.warning("Environment secret of {} is {} bytes (limit {}), not injecting".format(username, size, ENV_INJECTION_MAX_BYTES))
+        return
+
+    spawner.environment.update(injected)
+    spawner.environment["BUUNSTACK_INJECTED_ENV"] = ",".join(sorted(injected))
+    spawner.log.info("✅ Injected {} environment variables for {}".format(len(injected), username))
+
+
+# Notebook token refresh service
+# Running servers call POST /services/vault-token/ with their JupyterHub API token to get
+# a fresh Vault token when theirs approaches its max TTL, instead of restarting.
+# Kernels of the same server refreshing together share one token. The service runs on
+# the hub's event loop with the hub's Vault token, and indexes its tokens with the spawn
+# tokens, but is registered as a service with a role of its own: only the token of the
+# server being refreshed (access:servers!server=<user>/<server>) is accepted, not other
+# tokens of its user.
+VAULT_TOKEN_SERVICE_NAME = "vault-token"
+VAULT_TOKEN_SERVICE_PORT = 8082
+VAULT_TOKEN_SERVICE_API_TOKEN = new_token()
+REFRESH_REUSE_SECONDS = 60
+# spawner key -> (issued at, token auth)
+refreshed_tokens = {}
+
+vault_token_service_auth = HubAuth(
+    api_token=VAULT_TOKEN_SERVICE_API_TOKEN,
+    api_url=HUB_API_URL,
+    cache_max_age=60,
+)
+
+
+async def get_server_model(username, server_name):
+    """Return the hub's model of a user's server, or None (service role: read:servers)"""
+    response = await AsyncHTTPClient().fetch(
+        "{}/users/{}".format(HUB_API_URL, url_escape(username, plus=False)),
+        headers={"Authorization": "token {}".format(VAULT_TOKEN_SERVICE_API_TOKEN)},
+        raise_error=False,
+    )
+    if response.code != 200:
+        return None
+    return json.loads(response.body).get("servers", {}).get(server_name)
+
+
+class VaultTokenHandler(web.RequestHandler):
+    """Issue a fresh notebook Vault token to the running server whose API token calls it"""
+
+    async def post(self):
+        match = vault_token_service_auth.auth_header_pat.match(
+            self.request.headers.get("Authorization", "")
+        )
+        if not match:
+            raise web.HTTPError(403, "A server API token is required")
+        model = await vault_token_service_auth.user_for_token(match.group(1), sync=False)
+
+        server_name = self.get_argument("server_name", "")
+        username = (model or {}).get("name", "")
+        key = "{}/{}".format(username, server_name)
+        # The server's own token carries this scope; tokens the user holds for the hub,
+        # other servers or other services' OAuth clients do not
+        if not model or model.get("kind") != "user" or (
+            "access:servers!server={}".format(key) not in model.get("scopes", [])
+        ):
+            raise web.HTTPError(403, "Only the server's own API token can refresh its Vault token")
+
+        server = await get_server_model(username, server_name)
+        if not server or not server.get("ready"):
+            raise web.HTTPError(409, "Server is not running")
+
+        issued_at, token_auth = refreshed_tokens.get(key, (0, None))
+        if time.monotonic() - issued_at > REFRESH_REUSE_SECONDS:
+            loop = asyncio.get_running_loop()
+            token_auth = await loop.run_in_executor(
+                None,
+                lambda: issue_notebook_token(get_admin_vault_client(), username, key, app_log),
+            )
+            # Earlier tokens may still be in use by other kernels; they are revoked on stop
+            refreshed_tokens[key] = (time.monotonic(), token_auth)
+            app_log.info("✅ Refreshed notebook Vault token for {}".format(key))
+
+        self.set_header("Content-Type", "application/json")
+        self.write(
+            json.dumps(
+                {
+                    "token": token_auth["client_token"],
+                    "lease_duration": token_auth.get("lease_duration", 0),
+                }
+            )
+        )
+
+
+def start_vault_token_service():
+    """Serve the token refresh service on the hub event loop, behind its service route"""
+    application = web.Application(
+        [(r"/services/{}/?".format(VAULT_TOKEN_SERVICE_NAME), VaultTokenHandler)]
+    )
+    application.listen(VAULT_TOKEN_SERVICE_PORT)
+
+
+def start_token_maintenance():
+    """Start the revocation and sweep workers on the hub event loop (once)"""
+    if background_tasks:
+        return
+    workers = [revoke_tokens_worker()]
+    if SWEEP_INTERVAL > 0:
+        workers.append(sweep_tokens_worker())
+    for worker in workers:
+        task = asyncio.get_running_loop().create_task(worker)
+        background_tasks.add(task)
 {{- end }}
 
 async def pre_spawn_hook(spawner):
     """Set essential environment variables for spawned containers"""
     # PostgreSQL configuration
     spawner.environment["POSTGRES_HOST"] = "postgres-cluster-rw.postgres"
+    # Read-only replica service; has no endpoints while the cluster runs one instance
+    spawner.environment["POSTGRES_RO_HOST"] = "postgres-cluster-ro.postgres"
     spawner.environment["POSTGRES_PORT"] = "5432"
 
     # JupyterHub API configuration
     spawner.environment["JUPYTERHUB_API_URL"] = "http://hub:8081/hub/api"
 
+    # Keycloak token endpoint for OAuth2 clients (e.g. the Lakekeeper catalog)
+    spawner.environment["KEYCLOAK_TOKEN_URL"] = "https://{{ .Env.KEYCLOAK_HOST }}/realms/{{ .Env.KEYCLOAK_REALM }}/protocol/openid-connect/token"
+
     # Logging configuration
     spawner.environment["BUUNSTACK_LOG_LEVEL"] = "{{ .Env.JUPYTER_BUUNSTACK_LOG_LEVEL }}"
 
     {{- if eq .Env.JUPYTERHUB_VAULT_INTEGRATION_ENABLED "true" }}
+    start_token_maintenance()
+
     # Create user-specific Vault token directly
     try:
         username = spawner.user.name
 
         # Step 1: Initialize admin Vault client with file-based token
         vault_addr = os.environ.get("VAULT_ADDR", "{{ .Env.VAULT_ADDR }}")
-        vault_token = get_vault_token()
+
+        with observe_step("token_file_read"):
+            vault_token = get_vault_token()
+            if not vault_token:
+                raise Exception("No Vault token available from file or environment")
 
         spawner.log.info(f"pre_spawn_hook starting for {username}")
         spawner.log.info(f"Vault address: {vault_addr}")
         spawner.log.info(f"Vault token source: {'file' if os.path.exists('/vault/secrets/vault-token') else 'env'}")
         spawner.log.info(f"Vault token present: {bool(vault_token)}, length: {len(vault_token) if vault_token else 0}")
 
-        if not vault_token:
-            raise Exception("No Vault token available from file or environment")
-
-        vault_client = hvac.Client(url=vault_addr, verify=False)
-        vault_client.token = vault_token
-
-        if not vault_client.is_authenticated():
-            raise Exception("Admin token is not authenticated")
-
-        # Step 2: Create user-specific policy
-        user_policy_name = "jupyter-user-{}".format(username)
+        with observe_step("client_auth_check"):
+            vault_client = hvac.Client(url=vault_addr, verify=False)
+            vault_client.token = vault_token
 
-        # Read policy template from file
-        policy_template_path = "/srv/jupyterhub/user_policy.hcl"
-        with open(policy_template_path, 'r') as f:
-            policy_template = f.read()
-
-        # Replace {username} placeholder with actual username
-        user_policy = policy_template.replace("{username}", username)
-
-        # Write user-specific policy
-        try:
-            vault_client.sys.create_or_update_policy(user_policy_name, user_policy)
-            spawner.log.info("✅ Created policy: {}".format(user_policy_name))
-        except Exception as policy_e:
-            spawner.log.warning("Policy creation failed (may already exist): {}".format(policy_e))
+            if not vault_client.is_authenticated():
+                raise Exception("Admin token is not authenticated")
 
-        # Step 3: Create user-specific token
-        # Get TTL settings from environment variables
-        user_token_ttl = os.environ.get("NOTEBOOK_VAULT_TOKEN_TTL", "24h")
+        # Step 2-3: Create user-specific policy and token
         user_token_max_ttl = os.environ.get("NOTEBOOK_VAULT_TOKEN_MAX_TTL", "168h")
+        token_auth = issue_notebook_token(vault_client, username, spawner_key(spawner), spawner.log)
 
-        token_response = vault_client.auth.token.create_orphan(
-            policies=[user_policy_name],
-            ttl=user_token_ttl,
-            renewable=True,
-            display_name="notebook-{}".format(username),
-            explicit_max_ttl=user_token_max_ttl
-        )
-
-        user_vault_token = token_response["auth"]["client_token"]
-        lease_duration = token_response["auth"].get("lease_duration", 3600)
+        user_vault_token = token_auth["client_token"]
+        lease_duration = token_auth.get("lease_duration", 3600)
 
         # Set user-specific Vault token as environment variable
         spawner.environment["NOTEBOOK_VAULT_TOKEN"] = user_vault_token
+        # Service the server's kernels get fresh Vault tokens from (SecretStore)
+        spawner.environment["NOTEBOOK_VAULT_TOKEN_SERVICE_URL"] = "http://hub:{}/services/{}/".format(VAULT_TOKEN_SERVICE_PORT, VAULT_TOKEN_SERVICE_NAME)
 
         spawner.log.info("✅ User-specific Vault token created for {} (TTL: {}s, renewable, max TTL: {})".format(username, lease_duration, user_token_max_ttl))
 
+        # Step 4: Inject the user's environment secret
+        if ENV_INJECTION_ENABLED:
+            try:
+                inject_user_environment(spawner, vault_client)
+            except Exception as env_e:
+                spawner.log.warning("Environment secret injection failed for {}: {}".format(username, env_e))
+
     except Exception as e:
         spawner.log.error("Failed to create user-specific Vault token for {}: {}".format(spawner.user.name, e))
         import traceback
         spawner.log.error("Full traceback: {}".format(traceback.format_exc()))
     {{- end }}
 
-# Set the hook
-c.KubeSpawner.pre_spawn_hook = pre_spawn_hook
\ No newline at end of file
+{{- if eq .Env.JUPYTERHUB_VAULT_INTEGRATION_ENABLED "true" }}
+
+def post_stop_hook(spawner):
+    """Queue the stopped server's Vault tokens for revocation"""
+    start_token_maintenance()
+    refreshed_tokens.pop(spawner_key(spawner), None)
+    if REVOKE_ON_STOP:
+        revocation_queue.put_nowait((spawner_key(spawner), time.time()))
+        spawner.log.info("Queued revocation of Vault tokens for {}".format(spawner_key(spawner)))
+{{- end }}
+
+# Thread-pool sizing for the notebook container.
+# Native libraries size their pools from the node's core count, not the pod's
+# CPU quota, and get throttled hard when they oversubscribe it.
+THREAD_SIZING_ENABLED = os.environ.get("NOTEBOOK_THREAD_SIZING_ENABLED", "true") == "true"
+THREAD_POOL_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMEXPR_MAX_THREADS",
+    "POLARS_MAX_THREADS",
+    "RAYON_NUM_THREADS",
+    "TF_NUM_INTRAOP_THREADS",
+    "DUCKDB_THREADS",
+]
+# Share of the pod's memory DuckDB may use, leaving the rest to Python and other libraries
+DUCKDB_MEMORY_FRACTION = 0.75
+
+
+def get_cpu_threads(spawner):
+    """Threads to use for the pod: the CPU limit, else the guarantee, else None"""
+    cpus = spawner.cpu_limit or spawner.cpu_guarantee
+    if not cpus:
+        return None
+    return max(1, math.floor(cpus))
+
+
+def modify_pod_hook(spawner, pod):
+    """Size library thread pools and memory budgets from the pod's resources
+
+    Runs as modify_pod_hook rather than in pre_spawn_hook because KubeSpawner
+    applies the selected profile's kubespawner_override after pre_spawn_hook.
+    Variables already set on the container (e.g. through a profile's
+    ``environment`` override) are left as they are.
+    """
+    if not THREAD_SIZING_ENABLED:
+        return pod
+
+    container = next((c for c in pod.spec.containers if c.name == "notebook"), pod.spec.containers[0])
+    container.env = container.env or []
+    existing = {env.name: env.value for env in container.env}
+
+    sizing = {}
+    threads = existing.get("BUUNSTACK_CPU_THREADS") or get_cpu_threads(spawner)
+    if threads:
+        threads = str(threads)
+        sizing["BUUNSTACK_CPU_THREADS"] = threads
+        for name in THREAD_POOL_ENV_VARS:
+            sizing[name] = threads
+        # Inter-op parallelism multiplies intra-op threads, keep it at one
+        sizing["TF_NUM_INTEROP_THREADS"] = "1"
+
+    memory = spawner.mem_limit or spawner.mem_guarantee
+    if memory:
+        sizing["BUUNSTACK_MEMORY_LIMIT_BYTES"] = str(memory)
+        sizing["DUCKDB_MEMORY_LIMIT"] = "{}MiB".format(max(1, int(memory * DUCKDB_MEMORY_FRACTION) // 2**20))
+
+    for name, value in sizing.items():
+        if name not in existing:
+            container.env.append(V1EnvVar(name=name, value=value))
+
+    if threads or memory:
+        spawner.log.info(
+            "Sized {} to {} threads, DuckDB memory limit {}".format(
+                spawner.user.name, threads, sizing.get("DUCKDB_MEMORY_LIMIT")
+            )
+        )
+    return pod
+
+# Set the hooks
+c.KubeSpawner.pre_spawn_hook = pre_spawn_hook
+c.KubeSpawner.modify_pod_hook = modify_pod_hook
+{{- if eq .Env.JUPYTERHUB_VAULT_INTEGRATION_ENABLED "true" }}
+c.KubeSpawner.post_stop_hook = post_stop_hook
+
+# Notebook token refresh service, reached by servers at http://hub:8082/services/vault-token/
+c.JupyterHub.services.append(
+    {
+        "name": VAULT_TOKEN_SERVICE_NAME,
+        "url": "http://hub:{}".format(VAULT_TOKEN_SERVICE_PORT),
+        "api_token": VAULT_TOKEN_SERVICE_API_TOKEN,
+        "display": False,
+    }
+)
+c.JupyterHub.load_roles.append(
+    {
+        "name": "vault-token-service-role",
+        "scopes": ["read:servers"],
+        "services": [VAULT_TOKEN_SERVICE_NAME],
+    }
+)
+start_vault_token_service()
+# Revoke and sweep from startup on, not from the first spawn or stop
+start_token_maintenance()
+{{- end }}
\ No newline at end of file
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# Admin token retrieval and renewal for the JupyterHub hub
+#
+# Runs in the vault-token-renewer sidecar. Standard library only, so it runs
+# on a plain Python image without extra packages.
+#
+# - Waits for the admin token mounted from the ExternalSecret
+# - Publishes it atomically to /vault/secrets/vault-token for the hub
+# - Renews it at a jittered fraction of the TTL reported by lookup-self,
+#   backing off exponentially on failures
+# - Picks up a rotated token as soon as the mounted secret changes (inotify,
+#   falling back to polling where inotify is unavailable)
+# - Writes renewal metrics in Prometheus text format to
+#   /vault/secrets/renewer.prom, which the hub exports on /hub/metrics
+
+import ctypes
+import json
+import logging
+import os
+import random
+import select
+import ssl
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+VAULT_ADDR = os.environ.get("VAULT_ADDR", "").rstrip("/")
+VAULT_SKIP_VERIFY = os.environ.get("VAULT_SKIP_VERIFY", "false") == "true"
+ADMIN_TOKEN_DIR = os.environ.get("ADMIN_TOKEN_DIR", "/vault/admin-token")
+ADMIN_TOKEN_FILE = os.path.join(ADMIN_TOKEN_DIR, "token")
+TOKEN_FILE = os.environ.get("VAULT_TOKEN_FILE", "/vault/secrets/vault-token")
+METRICS_FILE = os.environ.get("RENEWER_METRICS_FILE", "/vault/secrets/renewer.prom")
+
+# Renew when this fraction of the current TTL has elapsed, +/- jitter
+RENEW_FRACTION = float(os.environ.get("RENEWER_RENEW_FRACTION", "0.5"))
+RENEW_JITTER = float(os.environ.get("RENEWER_RENEW_JITTER", "0.1"))
+MIN_INTERVAL = 30
+# Re-check interval for tokens that never expire or cannot be renewed
+RECHECK_INTERVAL = 3600
+BACKOFF_BASE = 5
+BACKOFF_MAX = 300
+POLL_INTERVAL = 5
+REQUEST_TIMEOUT = 10
+
+logging.basicConfig(
+    level=os.environ.get("RENEWER_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(message)s",
+)
+log = logging.getLogger("vault-token-renewer")
+
+
+class VaultError(Exception):
+    pass
+
+
+def vault_request(method, path, token, body=None):
+    """Call the Vault HTTP API and return the decoded JSON response"""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(
+        f"{VAULT_ADDR}/v1/{path}",
+        data=data,
+        method=method,
+        headers={"X-Vault-Token": token, "Content-Type": "application/json"},
+    )
+    context = ssl._create_unverified_context() if VAULT_SKIP_VERIFY else None
+    try:
+        with urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT, context=context) as resp:
+            return json.load(resp)
+    except urllib.error.HTTPError as e:
+        raise VaultError(f"{method} {path} returned {e.code}: {e.read().decode(errors='replace')}") from e
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise VaultError(f"{method} {path} failed: {e}") from e
+
+
+def lookup_self(token):
+    """Return (ttl_seconds, renewable) for the token"""
+    data = vault_request("GET", "auth/token/lookup-self", token)["data"]
+    return int(data.get("ttl") or 0), bool(data.get("renewable"))
+
+
+def renew_self(token):
+    """Renew the token and return the new lease duration in seconds"""
+    auth = vault_request("POST", "auth/token/renew-self", token, {})["auth"]
+    return int(auth.get("lease_duration") or 0)
+
+
+def write_atomic(path, content, mode=0o644):
+    """Write a file so that readers never see a partial write"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def read_admin_token():
+    try:
+        with open(ADMIN_TOKEN_FILE) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+class SecretWatcher:
+    """Wait for changes to the mounted secret directory
+
+    Kubernetes updates secret volumes by swapping the ..data symlink, so the
+    directory is watched rather than the token file itself.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            mask = (
+                self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE
+                | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+            )
+            if libc.inotify_add_watch(fd, path.encode(), mask) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch {path} failed")
+            self.fd = fd
+            log.info(f"Watching {path} with inotify")
+        except (OSError, AttributeError) as e:
+            log.warning(f"inotify unavailable ({e}), polling {path} every {POLL_INTERVAL}s")
+        self.fingerprint = self._fingerprint()
+
+    def _fingerprint(self):
+        try:
+            st = os.stat(os.path.join(self.path, "token"))
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _drain(self):
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds; return True if the secret changed"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.fd is not None:
+                readable, _, _ = select.select([self.fd], [], [], remaining)
+                if not readable:
+                    return False
+                # Let the symlink swap finish before reading the new token
+                time.sleep(0.5)
+                self._drain()
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+            fingerprint = self._fingerprint()
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                return True
+
+
+class Metrics:
+    """Renewal metrics, written in Prometheus text exposition format"""
+
+    def __init__(self):
+        self.renewals = {"success": 0, "failure": 0}
+        self.lookups = {"success": 0, "failure": 0}
+        self.token_reloads = 0
+        self.consecutive_failures = 0
+        self.token_ttl = 0
+        self.last_renewal = 0.0
+        self.next_renewal = 0.0
+
+    def write(self):
+        lines = [
+            "# HELP vault_token_renewer_renewals_total Admin token renewals.",
+            "# TYPE vault_token_renewer_renewals_total counter",
+        ]
+        lines += [f'vault_token_renewer_renewals_total{{status="{s}"}} {n}' for s, n in self.renewals.items()]
+        lines += [
+            "# HELP vault_token_renewer_lookups_total Admin token lookups.",
+            "# TYPE vault_token_renewer_lookups_total counter",
+        ]
+        lines += [f'vault_token_renewer_lookups_total{{status="{s}"}} {n}' for s, n in self.lookups.items()]
+        scalars = [
+            ("token_reloads_total", "counter", "Admin tokens picked up from the mounted secret.", self.token_reloads),
+            ("consecutive_failures", "gauge", "Lookup or renewal failures since the last success.", self.consecutive_failures),
+            ("token_ttl_seconds", "gauge", "Admin token TTL at the last lookup.", self.token_ttl),
+            ("last_renewal_timestamp_seconds", "gauge", "Time of the last successful renewal.", self.last_renewal),
+            ("next_renewal_timestamp_seconds", "gauge", "Time of the next scheduled renewal.", self.next_renewal),
+        ]
+        for name, kind, help_text, value in scalars:
+            lines += [
+                f"# HELP vault_token_renewer_{name} {help_text}",
+                f"# TYPE vault_token_renewer_{name} {kind}",
+                f"vault_token_renewer_{name} {value}",
+            ]
+        try:
+            write_atomic(METRICS_FILE, "\n".join(lines) + "\n")
+        except OSError as e:
+            log.warning(f"Failed to write metrics: {e}")
+
+
+def renewal_delay(ttl):
+    """Seconds to wait before renewing a token with the given TTL"""
+    delay = ttl * RENEW_FRACTION * random.uniform(1 - RENEW_JITTER, 1 + RENEW_JITTER)
+    return max(min(MIN_INTERVAL, ttl / 2), delay)
+
+
+def backoff_delay(failures):
+    """Exponential backoff with jitter"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def publish_token(token):
+    write_atomic(TOKEN_FILE, token + "\n")
+
+
+def reload_token(token, metrics):
+    """Adopt the token from the mounted secret if it changed"""
+    new_token = read_admin_token()
+    if not new_token or new_token == token:
+        return token
+    publish_token(new_token)
+    metrics.token_reloads += 1
+    metrics.consecutive_failures = 0
+    log.info("Admin token re-retrieved from ExternalSecret")
+    return new_token
+
+
+def main():
+    if not VAULT_ADDR:
+        raise SystemExit("VAULT_ADDR is not set")
+
+    log.info("Starting Vault token management...")
+    watcher = SecretWatcher(ADMIN_TOKEN_DIR)
+    metrics = Metrics()
+
+    log.info(f"Waiting for admin token from ExternalSecret at {ADMIN_TOKEN_FILE}...")
+    token = read_admin_token()
+    while not token:
+        watcher.wait(60)
+        token = read_admin_token()
+    publish_token(token)
+    log.info("Admin token retrieved from ExternalSecret")
+
+    while True:
+        try:
+            ttl, renewable = lookup_self(token)
+            metrics.lookups["success"] += 1
+        except VaultError as e:
+            metrics.lookups["failure"] += 1
+            metrics.consecutive_failures += 1
+            delay = backoff_delay(metrics.consecutive_failures)
+            log.error(f"Token lookup failed ({e}), retrying in {delay:.0f}s")
+            metrics.next_renewal = 0
+            metrics.write()
+            # The mounted token may have been rotated under us
+            if watcher.wait(delay) or read_admin_token() != token:
+                token = reload_token(token, metrics)
+            continue
+
+        can_renew = renewable and ttl > 0
+        delay = renewal_delay(ttl) if can_renew else RECHECK_INTERVAL
+        metrics.token_ttl = ttl
+        metrics.next_renewal = time.time() + delay if can_renew else 0
+        metrics.write()
+        if can_renew:
+            log.info(f"Token TTL: {ttl}s, next renewal in {delay:.0f}s")
+        else:
+            log.info(f"Token is not renewable or does not expire (TTL: {ttl}s), re-checking in {delay}s")
+
+        if watcher.wait(delay):
+            token = reload_token(token, metrics)
+            continue
+        if not can_renew:
+            continue
+
+        try:
+            lease_duration = renew_self(token)
+            metrics.renewals["success"] += 1
+            metrics.consecutive_failures = 0
+            metrics.last_renewal = time.time()
+            log.info(f"Token renewed successfully (lease duration: {lease_duration}s)")
+        except VaultError as e:
+            metrics.renewals["failure"] += 1
+            metrics.consecutive_failures += 1
+            delay = backoff_delay(metrics.consecutive_failures)
+            log.error(f"Token renewal failed ({e}), retrying in {delay:.0f}s")
+            metrics.write()
+            if watcher.wait(delay) or read_admin_token() != token:
+                token = reload_token(token, metrics)
+
+
+if __name__ == "__main__":
+    main()
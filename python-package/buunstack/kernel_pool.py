@@ -0,0 +1,207 @@
+"""
+Pool of pre-started kernels for Jupyter Server
+
+Enable it in a Jupyter Server config file:
+
+    c.ServerApp.kernel_manager_class = "buunstack.kernel_pool.PooledKernelManager"
+    c.ServerApp.jpserver_extensions.update({"buunstack.kernel_pool": True})
+
+Pooled kernels import the modules in ``preload_modules`` at startup (through
+``BUUNSTACK_KERNEL_PRELOAD``, see the image's ipython_kernel_config.py) and are
+handed to new sessions of ``pool_kernel_name``. Requires jupyter_server >= 2.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any
+
+from jupyter_server.services.kernels.kernelmanager import AsyncMappingKernelManager
+from jupyter_server.utils import ensure_async
+from traitlets import Float, Integer, List, Unicode, default
+
+PRELOAD_ENV = "BUUNSTACK_KERNEL_PRELOAD"
+MAX_POOL_SIZE = 4
+# Memory budgeted per pooled kernel: a warm kernel takes a few hundred MiB,
+# the rest is headroom for the work done in it
+MEMORY_PER_KERNEL = 2 * 1024**3
+
+
+def default_pool_size() -> int:
+    """
+    Pool size for the server's resources.
+
+    One kernel per two CPUs and per 2 GiB of memory, capped at 4. Reads the
+    limits published by the hub (``BUUNSTACK_CPU_THREADS``,
+    ``BUUNSTACK_MEMORY_LIMIT_BYTES``) and falls back to the machine's.
+    """
+    cpus = int(os.getenv("BUUNSTACK_CPU_THREADS") or 0) or os.cpu_count() or 1
+    memory = int(os.getenv("BUUNSTACK_MEMORY_LIMIT_BYTES") or 0) or (
+        os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    )
+    return max(0, min(MAX_POOL_SIZE, max(1, cpus // 2), memory // MEMORY_PER_KERNEL))
+
+
+class PooledKernelManager(AsyncMappingKernelManager):  # type: ignore[misc]
+    """
+    Kernel manager that hands out pre-started, pre-warmed kernels.
+
+    Pooled kernels are hidden from the kernel list and the idle culler until
+    a session takes them. The pool is refilled in the background after each
+    handout.
+    """
+
+    pool_size = Integer(
+        config=True,
+        help="Number of warm kernels to keep; defaults to default_pool_size().",
+    )
+    pool_kernel_name = Unicode(
+        "python3", config=True, help="Kernel spec to keep warm kernels of."
+    )
+    preload_modules = List(
+        Unicode(),
+        ["pandas", "pyarrow", "polars", "duckdb", "buunstack"],
+        config=True,
+        help="Modules imported by pooled kernels at startup.",
+    )
+    warm_timeout = Float(
+        120.0, config=True, help="Seconds to wait for a pooled kernel to finish starting."
+    )
+
+    @default("pool_size")
+    def _default_pool_size(self) -> int:
+        return default_pool_size()
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._pool: list[str] = []
+        self._pool_ids: set[str] = set()
+        self._fill_task: asyncio.Task[None] | None = None
+
+    async def _start_pooled_kernel(self) -> None:
+        env = {**os.environ, PRELOAD_ENV: ",".join(self.preload_modules)}
+        kernel_id = await super()._async_start_kernel(kernel_name=self.pool_kernel_name, env=env)
+        self._pool_ids.add(kernel_id)
+        # Warming up is not user activity
+        self.stop_watching_activity(kernel_id)
+        client = self.get_kernel(kernel_id).client()
+        client.start_channels()
+        try:
+            # Replies to kernel_info only once the preload has finished
+            await client.wait_for_ready(timeout=self.warm_timeout)
+        except Exception:
+            self._pool_ids.discard(kernel_id)
+            await ensure_async(self.shutdown_kernel(kernel_id, now=True))
+            raise
+        finally:
+            client.stop_channels()
+        self._pool.append(kernel_id)
+        self.log.info("Kernel %s added to the pool (%d warm)", kernel_id, len(self._pool))
+
+    async def _fill_pool(self) -> None:
+        while len(self._pool_ids) < self.pool_size:
+            try:
+                await self._start_pooled_kernel()
+            except Exception as e:
+                self.log.warning("Could not start a pooled kernel: %s", e)
+                return
+
+    def fill_pool(self) -> None:
+        """Start pooled kernels in the background until the pool is full."""
+        if self.pool_size > 0 and (self._fill_task is None or self._fill_task.done()):
+            self._fill_task = asyncio.create_task(self._fill_pool())
+
+    async def _adopt_kernel(self, kernel_id: str, path: str | None, env: dict[str, str]) -> None:
+        """Move a pooled kernel to the session's directory and environment."""
+        cwd = self.cwd_for_path(path, env=env) if path is not None else self.root_dir
+        updates = {k: v for k, v in env.items() if os.environ.get(k) != v}
+        code = (
+            "import os as _os\n"
+            f"_os.chdir({cwd!r})\n"
+            f"_os.environ.update({updates!r})\n"
+            f"_os.environ.pop({PRELOAD_ENV!r}, None)\n"
+            "del _os\n"
+        )
+        km = self.get_kernel(kernel_id)
+        client = km.client()
+        client.start_channels()
+        try:
+            msg_id = client.execute(code, silent=True, store_history=False)
+            while True:
+                reply = await client.get_shell_msg(timeout=30)
+                if reply["parent_header"].get("msg_id") == msg_id:
+                    break
+        finally:
+            client.stop_channels()
+        # Restarts relaunch with the session's directory and environment,
+        # without the preload
+        km._launch_args.update(cwd=cwd, env={k: v for k, v in env.items() if k != PRELOAD_ENV})
+        self.start_watching_activity(kernel_id)
+        km.execution_state = "idle"
+
+    async def _async_start_kernel(  # type: ignore[override]
+        self, *, kernel_id: str | None = None, path: str | None = None, **kwargs: Any
+    ) -> str:
+        kernel_name = kwargs.get("kernel_name") or self.default_kernel_name
+        if kernel_id is None and kernel_name == self.pool_kernel_name:
+            while self._pool:
+                pooled_id = self._pool.pop(0)
+                self._pool_ids.discard(pooled_id)
+                if pooled_id not in self:
+                    continue
+                try:
+                    await self._adopt_kernel(pooled_id, path, kwargs.get("env") or dict(os.environ))
+                except Exception as e:
+                    self.log.warning("Discarding pooled kernel %s: %s", pooled_id, e)
+                    await ensure_async(self.shutdown_kernel(pooled_id, now=True))
+                    continue
+                self.log.info("Using pooled kernel %s", pooled_id)
+                self.fill_pool()
+                return pooled_id
+            self.fill_pool()
+        return await super()._async_start_kernel(kernel_id=kernel_id, path=path, **kwargs)
+
+    start_kernel = _async_start_kernel
+
+    async def _async_shutdown_all(self, now: bool = False) -> None:
+        if self._fill_task is not None:
+            self._fill_task.cancel()
+        self.pool_size = 0
+        await super()._async_shutdown_all(now=now)
+
+    shutdown_all = _async_shutdown_all
+
+    def list_kernels(self) -> list[dict[str, Any]]:
+        return [k for k in super().list_kernels() if k["id"] not in self._pool_ids]
+
+    async def cull_kernel_if_idle(self, kernel_id: str) -> None:
+        if kernel_id not in self._pool_ids:
+            await super().cull_kernel_if_idle(kernel_id)
+
+    def remove_kernel(self, kernel_id: str) -> Any:
+        self._pool_ids.discard(kernel_id)
+        if kernel_id in self._pool:
+            self._pool.remove(kernel_id)
+        return super().remove_kernel(kernel_id)
+
+
+def _jupyter_server_extension_points() -> list[dict[str, str]]:
+    return [{"module": "buunstack.kernel_pool"}]
+
+
+def _load_jupyter_server_extension(serverapp: Any) -> None:
+    """Fill the pool once the server's event loop is running."""
+    kernel_manager = serverapp.kernel_manager
+    if not isinstance(kernel_manager, PooledKernelManager):
+        serverapp.log.warning(
+            "buunstack.kernel_pool is enabled but kernel_manager_class is not PooledKernelManager"
+        )
+        return
+    serverapp.log.info(
+        "Keeping %d warm '%s' kernels (preloading %s)",
+        kernel_manager.pool_size,
+        kernel_manager.pool_kernel_name,
+        ", ".join(kernel_manager.preload_modules),
+    )
+    serverapp.io_loop.add_callback(kernel_manager.fill_pool)
@@ -0,0 +1,402 @@
+"""
+Partitioned parallel reads from the buun-stack PostgreSQL cluster
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Literal
+
+from .secrets import SecretStore
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from pyspark.sql import DataFrame as SparkDataFrame
+    from pyspark.sql import SparkSession
+
+logger = logging.getLogger("buunstack")
+
+DEFAULT_BATCH_SIZE = 50_000
+# Upper bound on parallel connections per read, to stay well within
+# the cluster's max_connections
+MAX_PARTITIONS = 16
+CONNECT_TIMEOUT = 3
+
+_host_cache: dict[tuple[str | None, str | None], str] = {}
+_host_lock = threading.Lock()
+
+
+def _import_dependencies() -> tuple[Any, Any]:
+    try:
+        import psycopg2
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "psycopg2 and pyarrow are required for buunstack.postgres; "
+            "install buunstack[postgres]"
+        ) from e
+    return psycopg2, pyarrow
+
+
+def default_partitions() -> int:
+    """Number of partitions sized to the server's CPU allotment."""
+    threads = os.getenv("BUUNSTACK_CPU_THREADS")
+    count = int(threads) if threads else (os.cpu_count() or 1)
+    return max(1, min(MAX_PARTITIONS, count))
+
+
+def _credentials(secret: str | None, connect_kwargs: dict[str, Any]) -> dict[str, Any]:
+    """Merge credentials from SecretStore under explicit connection arguments."""
+    credentials: dict[str, Any] = {}
+    if secret:
+        data = SecretStore().get(secret)
+        for field in ("user", "password", "dbname"):
+            if field in data:
+                credentials[field] = data[field]
+    credentials.update(connect_kwargs)
+    return credentials
+
+
+def _resolve_host(credentials: dict[str, Any], prefer_replica: bool) -> str:
+    """
+    Return the host to read from: the read-only replica service if it accepts
+    connections, otherwise the primary.
+
+    CloudNativePG always creates the -ro service, but it has no endpoints while
+    the cluster runs a single instance, so reachability is probed once and cached.
+    """
+    psycopg2, _ = _import_dependencies()
+    primary = os.getenv("POSTGRES_HOST", "postgres-cluster-rw.postgres")
+    replica = os.getenv("POSTGRES_RO_HOST") if prefer_replica else None
+    if not replica:
+        return primary
+
+    key = (replica, primary)
+    with _host_lock:
+        if key not in _host_cache:
+            try:
+                psycopg2.connect(
+                    host=replica,
+                    port=os.getenv("POSTGRES_PORT", "5432"),
+                    connect_timeout=CONNECT_TIMEOUT,
+                    **credentials,
+                ).close()
+                _host_cache[key] = replica
+                logger.info(f"Reading from replica service {replica}")
+            except psycopg2.OperationalError as e:
+                _host_cache[key] = primary
+                logger.info(f"Replica service {replica} unavailable ({e}), using {primary}")
+        return _host_cache[key]
+
+
+def _split_range(lower: Any, upper: Any, num_partitions: int) -> list[Any]:
+    """Return num_partitions + 1 ascending, de-duplicated boundaries."""
+    if isinstance(lower, int) and isinstance(upper, int):
+        points = [lower + (upper - lower) * i // num_partitions for i in range(num_partitions)]
+    else:
+        # float, Decimal, date, datetime: all support (upper - lower) * i / n
+        points = [lower + (upper - lower) * i / num_partitions for i in range(num_partitions)]
+    boundaries = sorted(set(points))
+    boundaries.append(upper)
+    return boundaries
+
+
+def iter_batches(
+    source: str,
+    partition_column: str,
+    num_partitions: int | None = None,
+    lower_bound: Any = None,
+    upper_bound: Any = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    secret: str | None = None,
+    prefer_replica: bool = True,
+    **connect_kwargs: Any,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Read a table or query as Arrow record batches over parallel ranged reads.
+
+    Finds the bounds of partition_column (unless given), splits the range into
+    num_partitions half-open ranges and reads each one on its own connection
+    through a server-side cursor. Batches are yielded as they arrive, in no
+    particular order. When the server allows it, all partitions read from one
+    exported snapshot, so the result is consistent.
+
+    Parameters
+    ----------
+    source : str
+        Table name (optionally schema-qualified) or a SELECT query.
+    partition_column : str
+        Numeric, date or timestamp column to split on; ideally indexed.
+    num_partitions : int, optional
+        Number of parallel reads, by default sized to the server's CPUs.
+    lower_bound, upper_bound : optional
+        Range of partition_column; looked up with min()/max() if omitted.
+    batch_size : int, optional
+        Rows per Arrow batch, by default 50,000.
+    secret : str, optional
+        SecretStore secret with ``user``, ``password`` and ``dbname`` fields.
+    prefer_replica : bool, optional
+        Read from ``POSTGRES_RO_HOST`` when it accepts connections, by default True.
+    **connect_kwargs
+        Passed to psycopg2.connect() (e.g. user, password, dbname); libpq
+        environment variables such as PGUSER apply as usual.
+
+    Yields
+    ------
+    pyarrow.RecordBatch
+        Batches of up to batch_size rows.
+    """
+    psycopg2, pa = _import_dependencies()
+    from psycopg2 import sql
+
+    credentials = _credentials(secret, connect_kwargs)
+    host = _resolve_host(credentials, prefer_replica)
+    port = os.getenv("POSTGRES_PORT", "5432")
+    num_partitions = num_partitions or default_partitions()
+
+    if source.lstrip().lower().startswith(("select", "with")):
+        relation = sql.SQL("({}) AS source").format(sql.SQL(source))
+    else:
+        relation = sql.Identifier(*source.split("."))
+    column = sql.Identifier(partition_column)
+
+    coordinator = psycopg2.connect(host=host, port=port, **credentials)
+    coordinator.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        with coordinator.cursor() as cur:
+            snapshot = None
+            try:
+                cur.execute("SELECT pg_export_snapshot()")
+                snapshot = cur.fetchone()[0]
+            except psycopg2.Error as e:
+                logger.info(f"Snapshot export unavailable ({e}), partitions read independently")
+                coordinator.rollback()
+
+            if lower_bound is None or upper_bound is None:
+                cur.execute(
+                    sql.SQL("SELECT min({col}), max({col}) FROM {rel}").format(
+                        col=column, rel=relation
+                    )
+                )
+                low, high = cur.fetchone()
+                lower_bound = low if lower_bound is None else lower_bound
+                upper_bound = high if upper_bound is None else upper_bound
+
+        if lower_bound is None:
+            # Empty table or all NULLs: read it in one go
+            ranges = [(None, None)]
+        else:
+            boundaries = _split_range(lower_bound, upper_bound, num_partitions)
+            ranges = list(zip(boundaries[:-1], boundaries[1:])) or [(lower_bound, upper_bound)]
+        logger.info(f"Reading {source} from {host} in {len(ranges)} partitions")
+
+        def partition_query(index: int, low: Any, high: Any) -> tuple[Any, list[Any]]:
+            if low is None:
+                return sql.SQL("SELECT * FROM {rel}").format(rel=relation), []
+            last = index == len(ranges) - 1
+            condition = "{col} >= %s AND {col} " + ("<=" if last else "<") + " %s"
+            if index == 0:
+                # NULL keys are not in any range; read them with the first one
+                condition = f"({{col}} IS NULL OR {condition})"
+            query = sql.SQL("SELECT * FROM {rel} WHERE " + condition)
+            return query.format(rel=relation, col=column), [low, high]
+
+        batches: queue.Queue[Any] = queue.Queue(maxsize=len(ranges) * 2)
+        done = object()
+        cancelled = threading.Event()
+
+        def read_partition(index: int, low: Any, high: Any) -> None:
+            try:
+                query, params = partition_query(index, low, high)
+                conn = psycopg2.connect(host=host, port=port, **credentials)
+                try:
+                    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+                    if snapshot:
+                        with conn.cursor() as cur:
+                            cur.execute("SET TRANSACTION SNAPSHOT %s", [snapshot])
+                    with conn.cursor(name=f"buunstack_partition_{index}") as cur:
+                        cur.itersize = batch_size
+                        cur.execute(query, params)
+                        while not cancelled.is_set():
+                            rows = cur.fetchmany(batch_size)
+                            if not rows:
+                                break
+                            names = [desc.name for desc in cur.description]
+                            columns = list(zip(*rows))
+                            batches.put(pa.RecordBatch.from_arrays(
+                                [pa.array(values) for values in columns], names=names
+                            ))
+                finally:
+                    conn.close()
+                batches.put(done)
+            except BaseException as e:
+                batches.put(e)
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            for index, (low, high) in enumerate(ranges):
+                executor.submit(read_partition, index, low, high)
+            remaining = len(ranges)
+            try:
+                while remaining:
+                    item = batches.get()
+                    if item is done or isinstance(item, BaseException):
+                        remaining -= 1
+                        if item is not done:
+                            raise item
+                    else:
+                        yield item
+            finally:
+                cancelled.set()
+                # Unblock readers waiting on a full queue
+                while remaining:
+                    item = batches.get()
+                    if item is done or isinstance(item, BaseException):
+                        remaining -= 1
+    finally:
+        coordinator.close()
+
+
+def read_partitioned(
+    source: str,
+    partition_column: str,
+    output: Literal["pandas", "polars", "arrow"] = "pandas",
+    num_partitions: int | None = None,
+    lower_bound: Any = None,
+    upper_bound: Any = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    secret: str | None = None,
+    prefer_replica: bool = True,
+    **connect_kwargs: Any,
+) -> Any:
+    """
+    Read a table or query into pandas, polars or Arrow over parallel ranged reads.
+
+    See iter_batches() for the parameters. Row order is not preserved.
+
+    Parameters
+    ----------
+    output : {"pandas", "polars", "arrow"}, optional
+        Result type, by default "pandas".
+
+    Returns
+    -------
+    pandas.DataFrame, polars.DataFrame or pyarrow.Table
+
+    Examples
+    --------
+    >>> from buunstack.postgres import read_partitioned
+    >>> df = read_partitioned('public.ratings', 'user_id', secret='postgres')
+    >>> events = read_partitioned(
+    ...     "SELECT * FROM events WHERE kind = 'click'", 'created_at',
+    ...     output='polars', dbname='analytics',
+    ... )
+    """
+    _, pa = _import_dependencies()
+    tables = [
+        pa.Table.from_batches([batch])
+        for batch in iter_batches(
+            source,
+            partition_column,
+            num_partitions=num_partitions,
+            lower_bound=lower_bound,
+            upper_bound=upper_bound,
+            batch_size=batch_size,
+            secret=secret,
+            prefer_replica=prefer_replica,
+            **connect_kwargs,
+        )
+    ]
+    # Columns that are all NULL in one batch are typed differently; unify them
+    table = pa.concat_tables(tables, promote_options="permissive") if tables else pa.table({})
+    if output == "arrow":
+        return table
+    if output == "polars":
+        import polars as pl
+
+        return pl.from_arrow(table)
+    return table.to_pandas()
+
+
+def read_spark(
+    spark: SparkSession,
+    source: str,
+    partition_column: str,
+    num_partitions: int | None = None,
+    lower_bound: Any = None,
+    upper_bound: Any = None,
+    fetch_size: int = 10_000,
+    secret: str | None = None,
+    prefer_replica: bool = True,
+    **connect_kwargs: Any,
+) -> SparkDataFrame:
+    """
+    Read a table or query into Spark with partitioned JDBC reads.
+
+    Bounds are looked up like iter_batches() does and passed to
+    spark.read.jdbc(), so each Spark task reads its own range. Uses the
+    PostgreSQL JDBC driver baked into the datastack images.
+
+    Parameters
+    ----------
+    spark : pyspark.sql.SparkSession
+        Session to read with, e.g. from buunstack.spark.get_session().
+    fetch_size : int, optional
+        JDBC fetch size, by default 10,000.
+
+    Returns
+    -------
+    pyspark.sql.DataFrame
+    """
+    psycopg2, _ = _import_dependencies()
+    from psycopg2 import sql
+
+    credentials = _credentials(secret, connect_kwargs)
+    host = _resolve_host(credentials, prefer_replica)
+    port = os.getenv("POSTGRES_PORT", "5432")
+    is_query = source.lstrip().lower().startswith(("select", "with"))
+
+    if lower_bound is None or upper_bound is None:
+        relation = (
+            sql.SQL("({}) AS source").format(sql.SQL(source))
+            if is_query
+            else sql.Identifier(*source.split("."))
+        )
+        with psycopg2.connect(host=host, port=port, **credentials) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL("SELECT min({col}), max({col}) FROM {rel}").format(
+                        col=sql.Identifier(partition_column), rel=relation
+                    )
+                )
+                low, high = cur.fetchone()
+        conn.close()
+        lower_bound = low if lower_bound is None else lower_bound
+        upper_bound = high if upper_bound is None else upper_bound
+
+    dbname = credentials.get("dbname") or os.getenv("PGDATABASE", "postgres")
+    properties = {"driver": "org.postgresql.Driver", "fetchsize": str(fetch_size)}
+    user = credentials.get("user") or os.getenv("PGUSER")
+    password = credentials.get("password") or os.getenv("PGPASSWORD")
+    if user:
+        properties["user"] = user
+    if password:
+        properties["password"] = password
+
+    table = f"({source}) AS source" if is_query else source
+    reader = spark.read.option("sessionInitStatement", "SET default_transaction_read_only = on")
+    if lower_bound is None:
+        return reader.jdbc(f"jdbc:postgresql://{host}:{port}/{dbname}", table, properties=properties)
+    return reader.jdbc(
+        f"jdbc:postgresql://{host}:{port}/{dbname}",
+        table,
+        column=partition_column,
+        lowerBound=str(lower_bound),
+        upperBound=str(upper_bound),
+        numPartitions=num_partitions or default_partitions(),
+        properties=properties,
+    )
@@ -6,10 +6,12 @@ from __future__ import annotations
 
 import logging
 import os
+import time
 import warnings
 from typing import Any, overload
 
 import hvac
+import requests
 
 # Suppress SSL warnings for self-signed certificates
 warnings.filterwarnings("ignore", message="Unverified HTTPS request")
@@ -49,8 +51,9 @@ class SecretStore:
     """
     Secure secrets management with JupyterHub API authentication.
 
-    Uses JupyterHub's vault-token API endpoint to obtain Vault tokens
-    by exchanging auth_state JWT. Implements singleton pattern for
+    Uses the Vault token created at notebook spawn, and JupyterHub's
+    vault-token service to obtain a fresh one for the running server
+    before it reaches its max TTL. Implements singleton pattern for
     consistent state across imports.
 
     Examples
@@ -71,12 +74,20 @@ class SecretStore:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self):
+    def __init__(
+        self, sync_with_jupyterhub: bool = True, refresh_buffer_seconds: int = 600
+    ):
         """
         Initialize SecretStore with JupyterHub API authentication.
 
-        Uses JupyterHub's vault-token API endpoint to exchange
-        auth_state JWT for Vault tokens.
+        Parameters
+        ----------
+        sync_with_jupyterhub : bool, optional
+            Obtain a fresh Vault token from JupyterHub's vault-token service
+            when the current one cannot be renewed any further, by default True.
+        refresh_buffer_seconds : int, optional
+            Renew or refresh the token when it expires within this many seconds,
+            by default 600.
         """
         if self._initialized:
             return
@@ -84,6 +95,10 @@ class SecretStore:
         self.username = os.getenv("JUPYTERHUB_USER")
         self.vault_addr = os.getenv("VAULT_ADDR")
         self.base_path = f"jupyter/users/{self.username}"
+        self.sync_with_jupyterhub = sync_with_jupyterhub
+        self.refresh_buffer_seconds = refresh_buffer_seconds
+        self.vault_token_service_url = os.getenv("NOTEBOOK_VAULT_TOKEN_SERVICE_URL")
+        self.jupyterhub_api_token = os.getenv("JUPYTERHUB_API_TOKEN")
 
         # Using pre-acquired Vault token from notebook spawn
 
@@ -117,20 +132,75 @@ class SecretStore:
         self.client.token = vault_token
         logger.info("✅ Using user-specific Vault token from notebook spawn")
 
+    def _refresh_token_from_jupyterhub(self) -> bool:
+        """
+        Obtain a fresh Vault token for this server from JupyterHub.
+
+        Calls the hub's vault-token service with the server's JupyterHub
+        API token, so long-running kernels keep working past the token's max TTL
+        without restarting the notebook server.
+
+        Returns
+        -------
+        bool
+            True if a new token was obtained and is now in use.
+        """
+        if not (
+            self.sync_with_jupyterhub
+            and self.vault_token_service_url
+            and self.jupyterhub_api_token
+        ):
+            return False
+
+        try:
+            response = requests.post(
+                self.vault_token_service_url,
+                params={"server_name": os.getenv("JUPYTERHUB_SERVER_NAME", "")},
+                headers={"Authorization": f"token {self.jupyterhub_api_token}"},
+                timeout=30,
+            )
+            response.raise_for_status()
+            vault_token = response.json()["token"]
+        except Exception as e:
+            logger.warning(f"Could not refresh Vault token from JupyterHub: {e}")
+            return False
+
+        self.client.token = vault_token
+        # Subprocesses started from this kernel inherit the fresh token
+        os.environ["NOTEBOOK_VAULT_TOKEN"] = vault_token
+        logger.info("✅ Vault token refreshed from JupyterHub")
+        return True
+
     def _ensure_authenticated(self):
         """
         Ensure we have valid Vault authentication with token renewal.
+
+        Renews the token when it is close to expiry, and obtains a fresh one
+        from JupyterHub when it is close to its max TTL or no longer valid.
         """
         try:
             if self.client.is_authenticated():
                 # Check if token needs renewal (if renewable and close to expiry)
                 try:
                     token_info = self.client.auth.token.lookup_self()
-                    ttl = token_info.get("data", {}).get("ttl", 0)
-                    renewable = token_info.get("data", {}).get("renewable", False)
+                    data = token_info.get("data", {})
+                    ttl = data.get("ttl", 0)
+                    renewable = data.get("renewable", False)
+                    explicit_max_ttl = data.get("explicit_max_ttl", 0)
+                    creation_time = data.get("creation_time", 0)
+
+                    # Renewal cannot extend the token past its max TTL
+                    if explicit_max_ttl > 0 and creation_time:
+                        max_ttl_remaining = creation_time + explicit_max_ttl - time.time()
+                        if max_ttl_remaining < self.refresh_buffer_seconds:
+                            logger.info(
+                                f"Vault token reaches its max TTL in {max_ttl_remaining:.0f}s"
+                            )
+                            if self._refresh_token_from_jupyterhub():
+                                return
 
-                    # Renew if TTL < 10 minutes and renewable
-                    if renewable and ttl > 0 and ttl < 600:
+                    # Renew if close to expiry and renewable
+                    if renewable and ttl > 0 and ttl < self.refresh_buffer_seconds:
                         logger.info(f"Renewing Vault token (TTL: {ttl}s)")
                         self.client.auth.token.renew_self()
                         logger.info("✅ Vault token renewed successfully")
@@ -141,6 +211,10 @@ class SecretStore:
         except Exception:
             pass
 
+        # Token expired or invalid - try to get a fresh one from JupyterHub
+        if self._refresh_token_from_jupyterhub():
+            return
+
         # Token expired or invalid - provide helpful error message
         token_ttl = os.getenv("NOTEBOOK_VAULT_TOKEN_TTL", "24h")
         token_max_ttl = os.getenv("NOTEBOOK_VAULT_TOKEN_MAX_TTL", "168h")
@@ -585,6 +659,8 @@ class SecretStore:
             - username: JupyterHub username
             - vault_addr: Vault server address
             - authentication_method: Authentication method used
+            - sync_with_jupyterhub: Whether tokens are refreshed from JupyterHub
+            - jupyterhub_api_configured: Whether JupyterHub API URL and token are set
             - vault_authenticated: Whether Vault client is authenticated
 
         Examples
@@ -597,6 +673,10 @@ class SecretStore:
             "username": self.username,
             "vault_addr": self.vault_addr,
             "authentication_method": "User-specific Vault token",
+            "sync_with_jupyterhub": self.sync_with_jupyterhub,
+            "jupyterhub_api_configured": bool(
+                self.vault_token_service_url and self.jupyterhub_api_token
+            ),
         }
 
         try:
@@ -0,0 +1,292 @@
+"""
+Spark session factory preconfigured for buun-stack's MinIO and Lakekeeper
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import TYPE_CHECKING, Any
+
+from .secrets import SecretStore
+
+if TYPE_CHECKING:
+    from pyspark.sql import SparkSession
+
+logger = logging.getLogger("buunstack")
+
+DEFAULT_S3_ENDPOINT = "http://minio.minio.svc.cluster.local:9000"
+DEFAULT_CATALOG_URI = "http://lakekeeper.lakekeeper.svc.cluster.local:8181/catalog"
+
+# Settings shared by all profiles: S3A against MinIO, cloud committers and
+# vectorized Parquet reads. The connector JARs are baked into the image.
+COMMON_SETTINGS: dict[str, str] = {
+    "spark.hadoop.fs.s3a.impl": "org.apache.hadoop.fs.s3a.S3AFileSystem",
+    "spark.hadoop.fs.s3a.path.style.access": "true",
+    "spark.hadoop.fs.s3a.fast.upload": "true",
+    "spark.hadoop.fs.s3a.committer.magic.enabled": "true",
+    "spark.sql.sources.commitProtocolClass": (
+        "org.apache.spark.internal.io.cloud.PathOutputCommitProtocol"
+    ),
+    "spark.sql.parquet.output.committer.class": (
+        "org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter"
+    ),
+    "spark.sql.parquet.enableVectorizedReader": "true",
+    "spark.sql.parquet.enableNestedColumnVectorizedReader": "true",
+    "spark.sql.parquet.filterPushdown": "true",
+    "spark.sql.parquet.aggregatePushdown": "true",
+    "spark.sql.execution.arrow.pyspark.enabled": "true",
+}
+
+# Named tuning profiles, applied on top of COMMON_SETTINGS
+PROFILES: dict[str, dict[str, str]] = {
+    # Exploratory work: quick small reads, modest connection pool, uploads
+    # buffered in memory, magic committer for direct writes
+    "interactive": {
+        "spark.hadoop.fs.s3a.connection.maximum": "64",
+        "spark.hadoop.fs.s3a.threads.max": "32",
+        "spark.hadoop.fs.s3a.fast.upload.buffer": "bytebuffer",
+        "spark.hadoop.fs.s3a.fast.upload.active.blocks": "4",
+        "spark.hadoop.fs.s3a.multipart.size": "64M",
+        "spark.hadoop.fs.s3a.experimental.input.fadvise": "random",
+        "spark.hadoop.fs.s3a.committer.name": "magic",
+        "spark.sql.files.maxPartitionBytes": "64m",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": "64m",
+    },
+    # Large scans and writes: bigger pool and parts, disk-buffered uploads,
+    # partitioned committer. A path-based overwrite replaces only the partitions
+    # it writes through the committer's conflict-mode=replace, so Spark's
+    # partitionOverwriteMode stays static: PathOutputCommitProtocol rejects
+    # dynamic partition overwrite, which the S3A committers do not support
+    "batch": {
+        "spark.hadoop.fs.s3a.connection.maximum": "200",
+        "spark.hadoop.fs.s3a.threads.max": "64",
+        "spark.hadoop.fs.s3a.fast.upload.buffer": "disk",
+        "spark.hadoop.fs.s3a.fast.upload.active.blocks": "8",
+        "spark.hadoop.fs.s3a.multipart.size": "128M",
+        "spark.hadoop.fs.s3a.experimental.input.fadvise": "normal",
+        "spark.hadoop.fs.s3a.committer.name": "partitioned",
+        "spark.hadoop.fs.s3a.committer.staging.conflict-mode": "replace",
+        "spark.sql.files.maxPartitionBytes": "256m",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": "128m",
+    },
+}
+
+_session: SparkSession | None = None
+_session_key: tuple[Any, ...] | None = None
+
+
+def _read_secret(name: str | None) -> dict[str, Any]:
+    """Read a secret from SecretStore, returning {} if it is unavailable."""
+    if not name:
+        return {}
+    try:
+        return SecretStore().get(name)
+    except Exception as e:
+        logger.info(f"Secret '{name}' not available from SecretStore: {e}")
+        return {}
+
+
+def build_config(
+    profile: str = "interactive",
+    warehouse: str | None = None,
+    s3_secret: str | None = "minio",
+    catalog_secret: str | None = "lakekeeper",
+    catalog_name: str = "lakekeeper",
+    config: dict[str, str] | None = None,
+) -> dict[str, str]:
+    """
+    Build the Spark settings used by get_session().
+
+    Credentials are read from SecretStore and fall back to environment
+    variables (``AWS_ACCESS_KEY_ID``/``AWS_SECRET_ACCESS_KEY`` for MinIO,
+    ``OIDC_CLIENT_ID``/``OIDC_CLIENT_SECRET`` for Lakekeeper).
+
+    Parameters
+    ----------
+    profile : str, optional
+        Tuning profile, one of PROFILES, by default "interactive".
+    warehouse : str, optional
+        Lakekeeper warehouse to register as an Iceberg catalog. Defaults to
+        ``ICEBERG_WAREHOUSE``; no catalog is configured if neither is set.
+    s3_secret : str, optional
+        Secret holding ``access_key`` and ``secret_key`` for MinIO,
+        by default "minio".
+    catalog_secret : str, optional
+        Secret holding ``client_id`` and ``client_secret`` for Lakekeeper,
+        by default "lakekeeper".
+    catalog_name : str, optional
+        Name of the Iceberg catalog in Spark SQL, by default "lakekeeper".
+    config : dict[str, str], optional
+        Extra settings, applied last.
+
+    Returns
+    -------
+    dict[str, str]
+        Spark configuration.
+
+    Raises
+    ------
+    ValueError
+        If the profile is unknown.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}', expected one of {list(PROFILES)}")
+
+    s3_endpoint = os.getenv("AWS_ENDPOINT_URL", DEFAULT_S3_ENDPOINT)
+    settings = {
+        **COMMON_SETTINGS,
+        **PROFILES[profile],
+        "spark.hadoop.fs.s3a.endpoint": s3_endpoint,
+        "spark.hadoop.fs.s3a.connection.ssl.enabled": str(
+            s3_endpoint.startswith("https://")
+        ).lower(),
+    }
+
+    s3_credentials = _read_secret(s3_secret)
+    access_key = s3_credentials.get("access_key") or os.getenv("AWS_ACCESS_KEY_ID")
+    secret_key = s3_credentials.get("secret_key") or os.getenv("AWS_SECRET_ACCESS_KEY")
+    if access_key and secret_key:
+        settings.update(
+            {
+                "spark.hadoop.fs.s3a.aws.credentials.provider": (
+                    "org.apache.hadoop.fs.s3a.SimpleAWSCredentialsProvider"
+                ),
+                "spark.hadoop.fs.s3a.access.key": access_key,
+                "spark.hadoop.fs.s3a.secret.key": secret_key,
+            }
+        )
+    else:
+        logger.warning("No MinIO credentials found, s3a:// paths need vended credentials")
+
+    warehouse = warehouse or os.getenv("ICEBERG_WAREHOUSE")
+    if warehouse:
+        catalog = f"spark.sql.catalog.{catalog_name}"
+        settings.update(
+            {
+                "spark.sql.extensions": (
+                    "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions"
+                ),
+                catalog: "org.apache.iceberg.spark.SparkCatalog",
+                f"{catalog}.type": "rest",
+                f"{catalog}.uri": os.getenv("ICEBERG_CATALOG_URL", DEFAULT_CATALOG_URI),
+                f"{catalog}.warehouse": warehouse,
+                # Lakekeeper hands out short-lived S3 credentials per table
+                f"{catalog}.header.X-Iceberg-Access-Delegation": "vended-credentials",
+                f"{catalog}.io-impl": "org.apache.iceberg.aws.s3.S3FileIO",
+                f"{catalog}.s3.path-style-access": "true",
+            }
+        )
+        catalog_credentials = _read_secret(catalog_secret)
+        client_id = catalog_credentials.get("client_id") or os.getenv("OIDC_CLIENT_ID")
+        client_secret = catalog_credentials.get("client_secret") or os.getenv(
+            "OIDC_CLIENT_SECRET"
+        )
+        token_url = catalog_credentials.get("token_url") or os.getenv("KEYCLOAK_TOKEN_URL")
+        if client_id and client_secret and token_url:
+            settings.update(
+                {
+                    f"{catalog}.credential": f"{client_id}:{client_secret}",
+                    f"{catalog}.oauth2-server-uri": token_url,
+                    f"{catalog}.scope": os.getenv("OAUTH2_SCOPE", "lakekeeper"),
+                }
+            )
+        else:
+            logger.warning("No Lakekeeper client credentials found, catalog is unauthenticated")
+
+    settings.update(config or {})
+    return settings
+
+
+def get_session(
+    profile: str = "interactive",
+    app_name: str | None = None,
+    warehouse: str | None = None,
+    s3_secret: str | None = "minio",
+    catalog_secret: str | None = "lakekeeper",
+    catalog_name: str = "lakekeeper",
+    config: dict[str, str] | None = None,
+    refresh: bool = False,
+) -> SparkSession:
+    """
+    Get a SparkSession tuned for buun-stack's MinIO (S3A) and Lakekeeper.
+
+    The session is cached per kernel: calling get_session() again with the
+    same arguments returns the running session. Different arguments, or
+    ``refresh=True``, stop it and build a new one, since most of these
+    settings cannot change on a running SparkContext.
+
+    Resource settings (driver memory, cores, shuffle partitions) come from
+    the image's spark-defaults.conf, which is sized to the server's limits.
+
+    Parameters
+    ----------
+    profile : str, optional
+        Tuning profile: "interactive" (default) or "batch".
+    app_name : str, optional
+        Spark application name, by default "buunstack-<profile>".
+    warehouse, s3_secret, catalog_secret, catalog_name, config
+        See build_config().
+    refresh : bool, optional
+        Rebuild the session even if a matching one is running.
+
+    Returns
+    -------
+    pyspark.sql.SparkSession
+        The configured session.
+
+    Raises
+    ------
+    ImportError
+        If pyspark is not installed.
+
+    Examples
+    --------
+    >>> from buunstack.spark import get_session
+    >>> spark = get_session(warehouse='analytics')
+    >>> df = spark.read.parquet('s3a://datasets/events/')
+    >>> spark.sql('SELECT * FROM lakekeeper.sales.orders LIMIT 10').show()
+
+    >>> # Large writes
+    >>> spark = get_session('batch', warehouse='analytics')
+    """
+    global _session, _session_key
+
+    try:
+        from pyspark.sql import SparkSession
+    except ImportError as e:
+        raise ImportError(
+            "pyspark is required for buunstack.spark; install buunstack[spark]"
+        ) from e
+
+    key = (
+        profile,
+        app_name,
+        warehouse,
+        s3_secret,
+        catalog_secret,
+        catalog_name,
+        tuple(sorted((config or {}).items())),
+    )
+    if _session is not None and SparkSession.getActiveSession() is not None:
+        if key == _session_key and not refresh:
+            return _session
+        logger.info("Stopping the cached Spark session to apply new settings")
+        _session.stop()
+    _session = None
+
+    settings = build_config(
+        profile=profile,
+        warehouse=warehouse,
+        s3_secret=s3_secret,
+        catalog_secret=catalog_secret,
+        catalog_name=catalog_name,
+        config=config,
+    )
+    builder = SparkSession.builder.appName(app_name or f"buunstack-{profile}")
+    for name, value in settings.items():
+        builder = builder.config(name, value)
+    _session = builder.getOrCreate()
+    _session_key = key
+    logger.info(f"Created Spark session with profile '{profile}'")
+    return _session